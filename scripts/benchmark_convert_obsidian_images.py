@@ -0,0 +1,209 @@
+#!/usr/bin/env -S uv run --script
+#
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "pyvips>=3.0.0",
+#     "tqdm>=4.67.1",
+# ]
+# ///
+"""
+Benchmarks the phases of convert_obsidian_images.py on a synthetic vault.
+
+Usage:
+  ./scripts/benchmark_convert_obsidian_images.py --notes 2000 --images 500 --output before.json
+  ./scripts/benchmark_convert_obsidian_images.py --notes 2000 --images 500 --compare before.json
+
+A vault is generated in a temporary folder (or --vault, which is kept), then the
+reference scan, replace_image_references and create_converted_image phases are
+timed. Everything runs offline, results are written as JSON.
+"""
+from dataclasses import asdict, dataclass
+from pathlib import Path
+import argparse
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+from typing import Callable
+
+import pyvips
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import convert_obsidian_images as converter  # noqa: E402
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+         "incididunt ut labore et dolore magna aliqua").split()
+
+
+@dataclass
+class VaultSpec:
+    notes: int = 1000
+    images: int = 200
+    references_per_note: int = 3
+    image_width: int = 800
+    image_height: int = 600
+    folders: int = 10
+    paragraphs_per_note: int = 10
+    seed: int = 0
+
+
+def generate_vault(vault_path: Path, spec: VaultSpec) -> None:
+    """
+    Writes a vault with a .obsidian folder, `spec.images` PNG screenshots
+    spread over `spec.folders` folders and `spec.notes` notes that embed them
+    with Markdown links, embeds and wikilinks.
+    """
+    rng = random.Random(spec.seed)
+    (vault_path / ".obsidian").mkdir(parents=True, exist_ok=True)
+    (vault_path / "00 - Meta" / "Logs").mkdir(parents=True, exist_ok=True)
+    folders = [vault_path / f"Folder {i}" for i in range(spec.folders)]
+    for folder in folders:
+        (folder / "attachments").mkdir(parents=True, exist_ok=True)
+
+    images: list[Path] = []
+    for i in range(spec.images):
+        image_path = rng.choice(folders) / "attachments" / f"Pasted image {i:05}.png"
+        # flat blocks of colour with a little noise, roughly what screenshots look like
+        background = pyvips.Image.black(spec.image_width, spec.image_height, bands=3) + [rng.randrange(256) for _ in range(3)]
+        for _ in range(8):
+            x, y = rng.randrange(spec.image_width), rng.randrange(spec.image_height)
+            background = background.draw_rect([rng.randrange(256) for _ in range(3)], x, y,
+                                              rng.randrange(1, spec.image_width - x + 1),
+                                              rng.randrange(1, spec.image_height - y + 1), fill=True)
+        noise = pyvips.Image.gaussnoise(spec.image_width, spec.image_height, sigma=4, mean=0)
+        (background + noise).cast("uchar").copy(interpretation="srgb").pngsave(str(image_path))
+        images.append(image_path)
+
+    for i in range(spec.notes):
+        folder = rng.choice(folders)
+        lines = [f"# Note {i}", ""]
+        for _ in range(spec.paragraphs_per_note):
+            lines.append(" ".join(rng.choice(WORDS) for _ in range(60)))
+            lines.append("")
+        for _ in range(spec.references_per_note if images else 0):
+            image = rng.choice(images)
+            relative = image.relative_to(vault_path).as_posix()
+            lines.append(rng.choice((
+                f"![screenshot]({relative.replace(' ', '%20')})",
+                f"![[{image.name}]]",
+                f"![[{image.name}|400]]",
+                f"[see here](<{relative}>)",
+            )))
+            lines.append("")
+        (folder / f"Note {i:05}.md").write_text("\n".join(lines), encoding="utf-8")
+
+
+def timed(function: Callable[[], object], repeat: int) -> float:
+    # best of `repeat`, the least disturbed run is the most comparable one
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_benchmarks(vault_path: Path, repeat: int, encode_count: int,
+                   strategies: list[converter.EncodingStrategy]) -> tuple[dict[str, float], int]:
+    """
+    Times each phase on `vault_path` and returns the seconds per phase along
+    with the number of images the notes reference.
+    """
+    results: dict[str, float] = {}
+    md_files, png_files = converter.scan_vault(vault_path)
+    results["scan_vault"] = timed(lambda: converter.scan_vault(vault_path), repeat)
+
+    # a cold scan parses every note, a warm one reuses the manifest entries
+    results["reference_scan_cold"] = timed(lambda: converter.Manifest(vault_path).index_notes(md_files), repeat)
+    manifest = converter.Manifest(vault_path)
+    references, _ = manifest.index_notes(md_files)
+    results["reference_scan_warm"] = timed(lambda: manifest.index_notes(md_files), repeat)
+
+    renames = {png_file.name: png_file.with_suffix(".webp").name for png_file in png_files}
+    contents = [md_file.read_text(encoding="utf-8") for md_file in md_files]
+
+    def replace_all() -> None:
+        for content in contents:
+            converter.replace_image_references(content, renames)
+    results["replace_image_references"] = timed(replace_all, repeat)
+
+    sample = sorted(png_files)[:encode_count]
+    with tempfile.TemporaryDirectory() as scratch:
+        # encode copies so the vault stays the same between repeats and runs
+        copies = []
+        for png_file in sample:
+            copy = Path(scratch) / png_file.name
+            copy.write_bytes(png_file.read_bytes())
+            copies.append(copy)
+
+        def encode_all() -> None:
+            for copy in copies:
+                converter.create_converted_image(copy, strategies=strategies)
+        results["create_converted_image"] = timed(encode_all, repeat)
+    if sample:
+        results["create_converted_image_per_image"] = results["create_converted_image"] / len(sample)
+    return results, sum(1 for png_file in png_files if png_file.name in references)
+
+
+def compare(previous: dict, current: dict) -> None:
+    print(f"{'phase':<36}{'previous':>12}{'current':>12}{'change':>10}")
+    for phase, value in current["results"].items():
+        before = previous.get("results", {}).get(phase)
+        if before is None:
+            print(f"{phase:<36}{'-':>12}{value:>12.4f}")
+            continue
+        change = f"{(value - before) / before * 100:+.1f}%" if before else "-"
+        print(f"{phase:<36}{before:>12.4f}{value:>12.4f}{change:>10}")
+
+
+def main() -> None:
+    defaults = VaultSpec()
+    parser = argparse.ArgumentParser(description="Benchmark convert_obsidian_images.py on a synthetic vault.")
+    parser.add_argument("--notes", type=int, default=defaults.notes)
+    parser.add_argument("--images", type=int, default=defaults.images)
+    parser.add_argument("--references-per-note", type=int, default=defaults.references_per_note)
+    parser.add_argument("--image-width", type=int, default=defaults.image_width)
+    parser.add_argument("--image-height", type=int, default=defaults.image_height)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per phase, the fastest is kept (default: 3)")
+    parser.add_argument("--encode", type=int, default=10, help="number of images to encode (default: 10)")
+    parser.add_argument("--strategies", type=converter.parse_strategies, default="lossless",
+                        help="encoding strategies passed to create_converted_image (default: lossless)")
+    parser.add_argument("--vault", type=Path, default=None,
+                        help="generate the vault here and keep it, it is reused when it already exists")
+    parser.add_argument("--output", type=Path, default=None, help="write the results to this JSON file")
+    parser.add_argument("--compare", type=Path, default=None, help="print the change against an earlier JSON file")
+    args = parser.parse_args()
+
+    spec = VaultSpec(notes=args.notes, images=args.images, references_per_note=args.references_per_note,
+                     image_width=args.image_width, image_height=args.image_height, seed=args.seed)
+    with tempfile.TemporaryDirectory() as temporary:
+        vault_path = (args.vault or Path(temporary) / "vault").resolve()
+        if not (vault_path / ".obsidian").is_dir():
+            start = time.perf_counter()
+            generate_vault(vault_path, spec)
+            print(f"Generated {vault_path} in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+        results, referenced_images = run_benchmarks(vault_path, args.repeat, args.encode, args.strategies)
+
+    report = {
+        "spec": asdict(spec),
+        "referenced_images": referenced_images,
+        "repeat": args.repeat,
+        "strategies": [strategy.name for strategy in args.strategies],
+        "python": platform.python_version(),
+        "vips": f"{pyvips.version(0)}.{pyvips.version(1)}.{pyvips.version(2)}",
+        "results": results,
+    }
+    if args.compare:
+        compare(json.loads(args.compare.read_text(encoding="utf-8")), report)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,15 +8,40 @@
 # ]
 # ///
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from contextlib import contextmanager
+import argparse
+import hashlib
+import json
+import resource
 import sys
+import threading
 import os
 from pathlib import Path
 import re
 from re import Match
-from typing import Final
+from functools import partial
+from typing import Any, Callable, Final, Iterable, Iterator
+from urllib.parse import quote, unquote
 import pyvips
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from tqdm import tqdm
+
+
+# The one grammar used both to find references and to rewrite them.
+# Markdown image/link: ![alt](path/to/image%201.png), [alt](<path/to/image 1.png> "title")
+# Obsidian wikilink/embed: ![[image.png]], [[folder/image.png|300]] or [[image.png#section]]
+# No part can run past the next bracket or newline, and the whitespace around a link is
+# matched possessively so it is never tried both ways, scanning a note stays linear.
+REFERENCE_PATTERN: Final = re.compile(
+    r'!?\[[^\[\]\n]*+\]\(\s*+(?:<(?P<angle_link>[^<>\n]++)>|(?P<link>[^()<>"\n]*[^()<>"\s]))'
+    r'(?:\s++"[^"\n]*+")?\s*+\)'
+    r'|!?\[\[(?P<wikilink>[^\[\]|#\n]+)(?:[|#][^\[\]\n]*)?\]\]'
+)
+URL_SCHEME: Final = re.compile(r'[a-zA-Z][a-zA-Z0-9+.-]*://')
+# the query or fragment of a Markdown link target, not part of the file name
+LINK_SUFFIX: Final = re.compile(r'[?#].*', re.DOTALL)
 
 
 @dataclass
@@ -27,127 +52,752 @@ class ConvertedImage:
     new_size: int
     date_created: datetime
     date_modified: datetime
+    strategy: str = "lossless"
+    estimated_memory: int = 0
+    # size of the identical PNGs that were removed in favour of this one
+    deduplicated_size: int = 0
 
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_size - self.new_size
 
-def main() -> None:
-    if len(sys.argv) < 2:
-        print("Usage: convert_obsidian_images.py <vault_folder>")
-        sys.exit(1)
 
-    vault_path = Path(sys.argv[1])
-    #.resolve()
+@dataclass(frozen=True)
+class EncodingStrategy:
+    """
+    One way of encoding an image. Lossless strategies are always accepted,
+    the others have to reach the minimum SSIM against the original. With
+    `search_quality` the lowest Q in QUALITY_STEPS that still does is used.
+    """
+    name: str
+    suffix: str
+    options: dict[str, Any]
+    lossless: bool = False
+    search_quality: bool = False
+
+
+@dataclass
+class EncodedCandidate:
+    strategy: EncodingStrategy
+    data: bytes
+    ssim: float | None
+
+
+class MemoryBudget:
+    """
+    Limits how much decoded image data concurrent conversions may hold. Each
+    conversion reserves its estimate up front and waits while the budget is
+    used up; an image larger than the whole budget still runs, but alone.
+    """
+
+    def __init__(self, limit: int | None = None):
+        self.limit = limit
+        self.used = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, amount: int) -> Iterator[None]:
+        with self._condition:
+            while self.limit and self.used and self.used + amount > self.limit:
+                self._condition.wait()
+            self.used += amount
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.used -= amount
+                self._condition.notify_all()
+
+
+# Keeping the PNG is always a candidate, so nothing larger than it gets written
+KEEP_ORIGINAL: Final = "original"
+QUALITY_STEPS: Final = (50, 55, 60, 65, 70, 75, 80, 85, 90, 95)
+STRATEGIES: Final = {
+    strategy.name: strategy for strategy in (
+        EncodingStrategy("lossless", ".webp", {"Q": 100, "lossless": True, "strip": False}, lossless=True),
+        EncodingStrategy("near-lossless", ".webp", {"Q": 60, "near_lossless": True, "strip": False}),
+        EncodingStrategy("lossy", ".webp", {"smart_subsample": True, "strip": False}, search_quality=True),
+        EncodingStrategy("avif", ".avif", {"compression": "av1", "strip": False}, search_quality=True),
+    )
+}
+
+
+@dataclass(frozen=True)
+class Reference:
+    """
+    A link, embed or wikilink target in a note. `target` is the decoded path,
+    `group` the regex group holding its raw text, `suffix` the raw `?query` or
+    `#fragment` of a Markdown link, kept when the link is rewritten.
+    """
+    group: str
+    target: str
+    suffix: str = ""
+
+    @property
+    def name(self) -> str:
+        return self.target.rsplit("/", 1)[-1]
+
+
+@dataclass
+class PlannedConversion:
+    png_file: Path
+    found_in: list[Path]
+    # byte-identical copies that will point at this image's conversion instead
+    duplicates: list["PlannedConversion"] = field(default_factory=list)
+
+
+class Manifest:
+    """
+    Remembers, between runs, what every note references and what happened to
+    every image, stored in the vault's .obsidian folder. Notes are keyed by
+    vault-relative path and only re-read when their size or mtime changed;
+    images are only reconsidered when they are new, changed, or newly referenced.
+    An image kept because a note's reference to it couldn't be updated is
+    "unresolved" and waits for that note to change, a "failed" one is retried every run.
+    """
+    FILE_NAME: Final = "convert_obsidian_images.json"
+    VERSION: Final = 2
+
+    def __init__(self, vault_path: Path, notes: dict[str, dict] | None = None, images: dict[str, dict] | None = None):
+        self.vault_path = vault_path
+        self.notes: dict[str, dict] = notes or {}
+        self.images: dict[str, dict] = images or {}
+
+    @classmethod
+    def load(cls, vault_path: Path) -> "Manifest":
+        path = vault_path / ".obsidian" / cls.FILE_NAME
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+            if data.get("version") == cls.VERSION:
+                return cls(vault_path, data["notes"], data["images"])
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Ignoring unreadable manifest {path}: {e}")
+        return cls(vault_path)
+
+    def save(self) -> None:
+        path = self.vault_path / ".obsidian" / self.FILE_NAME
+        data = {"version": self.VERSION, "notes": self.notes, "images": self.images}
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(data, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    def key(self, path: Path) -> str:
+        return path.relative_to(self.vault_path).as_posix()
+
+    def index_notes(self, md_files: dict[Path, os.stat_result]) -> tuple[dict[str, list[Path]], set[str]]:
+        """
+        Builds the reference index from the manifest, re-reading only notes whose
+        stat changed. Returns the index and the names referenced by re-read notes.
+        """
+        notes: dict[str, dict] = {}
+        index: dict[str, list[Path]] = {}
+        changed_references: set[str] = set()
+        for md_file, stat in md_files.items():
+            key = self.key(md_file)
+            entry = self.notes.get(key)
+            if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+                try:
+                    content = md_file.read_text(encoding="utf-8")
+                except Exception as e:
+                    print(f"Failed to read {md_file}: {e}")
+                    continue
+                entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                         "references": sorted(extract_references(content))}
+                changed_references.update(entry["references"])
+            notes[key] = entry
+            for name in entry["references"]:
+                index.setdefault(name, []).append(md_file)
+        # notes that disappeared from the vault are dropped here
+        self.notes = notes
+        return index, changed_references
+
+    def image_changed(self, png_file: Path, stat: os.stat_result) -> bool:
+        entry = self.images.get(self.key(png_file))
+        return (entry is None or entry["outcome"] == "failed"
+                or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns)
+
+    def record_image(self, png_file: Path, stat: os.stat_result, content_hash: str | None, outcome: str) -> None:
+        self.images[self.key(png_file)] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "hash": content_hash,
+            "outcome": outcome,
+        }
+
+    def forget_missing_images(self, png_files: dict[Path, os.stat_result]) -> None:
+        keys = {self.key(png_file) for png_file in png_files}
+        self.images = {key: entry for key, entry in self.images.items()
+                       if key in keys or entry["outcome"] == "converted"}
+
+
+def parse_args() -> argparse.Namespace:
+    cpu_count = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Convert PNG images referenced in an Obsidian vault to lossless webp.")
+    parser.add_argument("vault_folder", type=Path, help="path to the Obsidian vault")
+    parser.add_argument("--batch", action="store_true",
+                        help="ask for a single confirmation for all images instead of one per image")
+    parser.add_argument("-y", "--yes", action="store_true",
+                        help="convert everything without asking (implies --batch)")
+    parser.add_argument("-j", "--jobs", type=int, default=cpu_count,
+                        help=f"number of images to encode at the same time (default: {cpu_count})")
+    parser.add_argument("--vips-concurrency", type=int, default=None,
+                        help="libvips threads used by each encode (default: cpu count / jobs)")
+    parser.add_argument("--strategies", type=parse_strategies, default="lossless",
+                        help=f"comma separated encodings to try, the smallest acceptable one wins "
+                             f"({', '.join(STRATEGIES)}; default: lossless)")
+    parser.add_argument("--min-ssim", type=float, default=0.99,
+                        help="lowest SSIM a lossy encoding may have against the original (default: 0.99)")
+    parser.add_argument("--max-memory", type=int, default=None, metavar="MB",
+                        help="estimated decoded image memory all running conversions may use together")
+    parser.add_argument("--max-dimension", type=int, default=None, metavar="PIXELS",
+                        help="shrink larger images on load so neither side exceeds this")
+    parser.add_argument("--vips-cache-mem", type=int, default=None, metavar="MB",
+                        help="memory libvips may keep in its operation cache")
+    parser.add_argument("--vips-cache-max", type=int, default=None, metavar="OPERATIONS",
+                        help="number of operations libvips may keep in its operation cache")
+    parser.add_argument("--full", action="store_true",
+                        help=f"ignore .obsidian/{Manifest.FILE_NAME} and rescan every note and image")
+    return parser.parse_args()
+
+
+def parse_strategies(value: str) -> list[EncodingStrategy]:
+    try:
+        return [STRATEGIES[name.strip()] for name in value.split(",") if name.strip()]
+    except KeyError as e:
+        raise argparse.ArgumentTypeError(f"unknown strategy {e}, expected some of: {', '.join(STRATEGIES)}")
+
+
+def main() -> None:
+    args = parse_args()
+    vault_path: Path = args.vault_folder.resolve()
     obsidian_folder = vault_path / ".obsidian"
     if not obsidian_folder.exists() or not obsidian_folder.is_dir():
         print(f"Error: {vault_path} is not an Obsidian vault (missing .obsidian folder)")
         sys.exit(1)
 
-    # Find all .png images recursively
-    png_files = list(vault_path.rglob("*.png"))
-    if not png_files:
-        print("No PNG images found.")
+    # One walk for notes and images, the manifest decides what needs another look
+    md_files, png_files = scan_vault(vault_path)
+    manifest = Manifest(vault_path) if args.full else Manifest.load(vault_path)
+    references, changed_references = manifest.index_notes(md_files)
+    manifest.forget_missing_images(png_files)
+    candidates = [png_file for png_file, stat in png_files.items()
+                  if png_file.name in changed_references or manifest.image_changed(png_file, stat)]
+    try:
+        convert_candidates(args, vault_path, manifest, candidates, png_files, references)
+    finally:
+        manifest.save()
+
+
+def convert_candidates(args: argparse.Namespace, vault_path: Path, manifest: Manifest, candidates: list[Path],
+                       png_files: dict[Path, os.stat_result], references: dict[str, list[Path]]) -> None:
+    if not candidates:
+        print("No new or changed PNG images found.")
         return
 
-    # Find all markdown files
-    md_files = list(vault_path.rglob("*.md"))
+    planned = plan_conversions(candidates, references)
+    # filled by group_duplicates, only images that share their size with another one get hashed
+    hashes: dict[Path, str] = {}
+    for png_file in candidates:
+        if png_file.name not in references:
+            manifest.record_image(png_file, png_files[png_file], None, "unreferenced")
+    if not planned:
+        print("No referenced PNG images to convert.")
+        return
 
+    if args.batch or args.yes:
+        total_size = sum(png_files[item.png_file].st_size for item in planned)
+        note_count = len(set(md for item in planned for md in item.found_in))
+        print(f"{len(planned)} image(s) ({total_size / 1000} KB) referenced from {note_count} note(s) will be converted.")
+        if not args.yes and input("Convert all of them and replace their references? (y/n) ").lower() != 'y':
+            print("Skipping conversion.")
+            return
+    else:
+        confirmed = []
+        for item in planned:
+            if confirm_conversion(item):
+                confirmed.append(item)
+            else:
+                manifest.record_image(item.png_file, png_files[item.png_file], None, "skipped")
+        planned = confirmed
 
-    # TODO: Optimization strategy
-    # Check for files whose Date-Modified is older than Date-Created of the PNG
-    for png_file in png_files:
-        print(f"Image: {png_file}")
-        png_name = png_file.name
-        found_in = []
-        for md_file in md_files:
+    planned = group_duplicates(planned, png_files, hashes)
+    jobs = max(1, args.jobs)
+    pyvips.concurrency_set(args.vips_concurrency or max(1, (os.cpu_count() or 1) // jobs))
+    if args.vips_cache_mem is not None:
+        pyvips.cache_set_max_mem(args.vips_cache_mem * 1024 * 1024)
+    if args.vips_cache_max is not None:
+        pyvips.cache_set_max(args.vips_cache_max)
+    budget = MemoryBudget(args.max_memory * 1024 * 1024 if args.max_memory else None)
+    encode = partial(create_converted_image, strategies=args.strategies, min_ssim=args.min_ssim,
+                     max_dimension=args.max_dimension, budget=budget)
+    converted: list[tuple[PlannedConversion, ConvertedImage]] = []
+    for item, converted_image in tqdm(convert_all(planned, jobs, encode), total=len(planned), desc="Converting images"):
+        if converted_image is not None:
+            tqdm.write(f"  {item.png_file.name}: estimated {converted_image.estimated_memory / 1e6:.1f} MB")
+        if converted_image is None or converted_image.strategy == KEEP_ORIGINAL:
+            outcome = "failed" if converted_image is None else "kept"
+            for png_file in [item.png_file, *(duplicate.png_file for duplicate in item.duplicates)]:
+                manifest.record_image(png_file, png_files[png_file], hashes.get(png_file), outcome)
+        else:
+            converted.append((item, converted_image))
+    # the conversions share the process, so its peak is only meaningful for the whole run
+    print(f"Peak RSS {peak_rss() / 1e6:.1f} MB for {len(planned)} conversion(s), {jobs} at a time")
+
+    committed, unresolved = commit_conversions(converted, vault_path,
+                                               vault_path / "00 - Meta/Logs/Converted Files.md", png_files)
+
+    def outcome(png_file: Path, done: str) -> str:
+        return done if png_file in committed else "unresolved" if png_file in unresolved else "failed"
+    for item, _ in converted:
+        manifest.record_image(item.png_file, png_files[item.png_file], hashes.get(item.png_file),
+                              outcome(item.png_file, "converted"))
+        for duplicate in item.duplicates:
+            manifest.record_image(duplicate.png_file, png_files[duplicate.png_file], hashes[duplicate.png_file],
+                                  outcome(duplicate.png_file, "deduplicated"))
+
+
+def scan_vault(vault_path: Path) -> tuple[dict[Path, os.stat_result], dict[Path, os.stat_result]]:
+    """
+    Walks the vault once and returns the stat of every note and PNG image.
+    Hidden folders like .obsidian and .trash are skipped, Obsidian ignores them too.
+    """
+    md_files: dict[Path, os.stat_result] = {}
+    png_files: dict[Path, os.stat_result] = {}
+    for root, dirs, files in os.walk(vault_path):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for file in files:
+            suffix = os.path.splitext(file)[1].lower()
+            if suffix not in (".md", ".png"):
+                continue
+            path = Path(root, file)
             try:
-                content = md_file.read_text(encoding="utf-8")
-            except Exception:
-                # TODO: add logging
+                stat = path.stat()
+            except OSError:
                 continue
-            # Markdown image/link: ![alt](path/to/image.png) or [alt](path/to/image.png)
-            possible_found_in : re.Match[str] | None = re.search(rf'[\[\(][^\]\)]*({re.escape(png_name)})[\]\)]', content)
-            if possible_found_in:
-                print(f"  Found in {md_file} -> \"{possible_found_in.group(0)}\" aka \"{possible_found_in.group(1)}\"")
-                found_in.append(md_file)
+            (md_files if suffix == ".md" else png_files)[path] = stat
+    return md_files, png_files
+
+
+def hash_file(path: Path) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with path.open("rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def plan_conversions(png_files: list[Path], references: dict[str, list[Path]]) -> list[PlannedConversion]:
+    planned: list[PlannedConversion] = []
+    for png_file in png_files:
+        print(f"Image: {png_file}")
+        found_in = references.get(png_file.name, [])
         if len(found_in) > 0:
             print("  Referenced in:")
             for md in found_in:
                 print(f"    {md}")
-            # ask to confirm replacement
-            response = input(f"  Replace references to '{png_name}' with webp version? (y/n) ")
-            if response.lower() != 'y':
-                print("  Skipping conversion.")
-                continue
-            converted_image = create_converted_image(png_file)
-            if converted_image:
-                append_to_log([converted_image], vault_path / "00 - Meta/Logs/Converted Files.md")
-                for md in found_in:
-                    try:
-                        md_content = md.read_text(encoding="utf-8")
-                        updated_content = replace_image_references(md_content, png_name, converted_image.new_path.name)
-                        md.write_text(updated_content, encoding="utf-8")
-                        print(f"  Updated references in {md}")
-                    except Exception as e:
-                        print(f"  Failed to update {md}: {e}")
-                # delete original png
-                try:
-                    os.remove(png_file)
-                    print(f"  Deleted original PNG: {png_file}")
-                except Exception as e:
-                    print(f"  Failed to delete original PNG {png_file}: {e}")
+            planned.append(PlannedConversion(png_file, found_in))
         else:
             print("  Not referenced in any markdown file.")
+    return planned
+
+
+def group_duplicates(planned: list[PlannedConversion], png_files: dict[Path, os.stat_result],
+                     hashes: dict[Path, str]) -> list[PlannedConversion]:
+    """
+    Groups byte-identical images, by size first and then by content hash, so
+    each distinct image is encoded once. Only images sharing their size with
+    another one are read, their hashes are added to `hashes`. The first path
+    of every group is kept and the others are attached to it as duplicates.
+    """
+    by_size: dict[int, list[PlannedConversion]] = {}
+    for item in planned:
+        by_size.setdefault(png_files[item.png_file].st_size, []).append(item)
+    unique: list[PlannedConversion] = []
+    for same_size in by_size.values():
+        if len(same_size) == 1:
+            unique.extend(same_size)
+            continue
+        for item in same_size:
+            hashes[item.png_file] = hash_file(item.png_file)
+        by_hash: dict[str, PlannedConversion] = {}
+        for item in sorted(same_size, key=lambda item: item.png_file):
+            canonical = by_hash.setdefault(hashes[item.png_file], item)
+            if canonical is not item:
+                canonical.duplicates.append(item)
+        unique.extend(by_hash.values())
+    duplicate_count = sum(len(item.duplicates) for item in unique)
+    if duplicate_count:
+        print(f"Found {duplicate_count} duplicate image(s), {len(unique)} unique image(s) will be encoded.")
+    return unique
+
+
+def confirm_conversion(item: PlannedConversion) -> bool:
+    response = input(f"Replace references to '{item.png_file}' with webp version? (y/n) ")
+    if response.lower() != 'y':
+        print("  Skipping conversion.")
+        return False
+    return True
+
+
+def convert_all(planned: list[PlannedConversion], jobs: int,
+                encode: Callable[[Path], ConvertedImage | None] | None = None
+                ) -> Iterator[tuple[PlannedConversion, ConvertedImage | None]]:
+    """
+    Encodes the planned images on a thread pool and yields them as they finish.
+    libvips releases the GIL while it works, so threads are enough to keep
+    `jobs` encodes running at once.
+    """
+    encode = encode or create_converted_image
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(encode, item.png_file): item for item in planned}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def commit_conversions(converted: list[tuple[PlannedConversion, ConvertedImage]], vault_path: Path,
+                       log_path: Path, png_files: Iterable[Path]) -> tuple[set[Path], set[Path]]:
+    """
+    Points every note at the new webp files and only then deletes the PNGs.
+    Each note is rewritten once for all of its images and replaced atomically,
+    and a PNG is only deleted when every note referencing it was updated, so
+    an interrupted run never leaves a note pointing at a missing image.
+    References are resolved to the image they point at among `png_files`, two
+    images with the same name in different folders are never mixed up.
+    References to duplicates are pointed at the vault path of the one converted
+    copy. Returns the PNGs that were deleted, and the ones kept because a note
+    still points at them, its reference ambiguous or the note not writable.
+    """
+    by_name: dict[str, list[Path]] = {}
+    for png_file in png_files:
+        by_name.setdefault(png_file.name, []).append(png_file)
+    renames: dict[Path, str] = {}
+    notes: dict[Path, set[Path]] = {}
+    for item, converted_image in converted:
+        group = [item, *item.duplicates]
+        # a bare name only works when it stays next to the webp, duplicates need the full path
+        new_target = (converted_image.new_path.relative_to(vault_path).as_posix() if item.duplicates
+                      else converted_image.new_path.name)
+        for member in group:
+            renames[member.png_file] = new_target
+            for md in member.found_in:
+                notes.setdefault(md, set()).add(member.png_file)
+
+    # number of notes that may still point at each PNG
+    pending: dict[Path, int] = {png_file: 0 for png_file in renames}
+    renamed_names = {png_file.name for png_file in renames}
+    for md, png_paths in notes.items():
+        # names this note uses without saying which of the images sharing them it means
+        unresolved: set[str] = set()
+
+        def resolve(reference: Reference) -> Path | None:
+            png_file = resolve_reference(reference, md, vault_path, by_name)
+            if png_file is None and reference.name in renamed_names:
+                unresolved.add(reference.name)
+            return png_file
+        try:
+            md_content = md.read_text(encoding="utf-8")
+            updated_content, replaced = replace_image_references(md_content, renames, resolve)
+            if replaced:
+                write_text_atomic(md, updated_content)
+                print(f"  Updated references in {md}")
+        except Exception as e:
+            print(f"  Failed to update {md}: {e}")
+            unresolved = {png_file.name for png_file in png_paths}
+        for png_file in png_paths:
+            if png_file.name in unresolved:
+                pending[png_file] += 1
+
+    deleted: set[Path] = set()
+    unresolved_files: set[Path] = set()
+    committed: list[ConvertedImage] = []
+    for item, converted_image in converted:
+        for member in [item, *item.duplicates]:
+            if pending[member.png_file]:
+                print(f"  Keeping original PNG {member.png_file}, not every reference could be updated")
+                unresolved_files.add(member.png_file)
+                continue
+            # delete original png
+            try:
+                size = member.png_file.stat().st_size
+                os.remove(member.png_file)
+                print(f"  Deleted original PNG: {member.png_file}")
+                deleted.add(member.png_file)
+                if member is not item:
+                    converted_image.deduplicated_size += size
+            except Exception as e:
+                print(f"  Failed to delete original PNG {member.png_file}: {e}")
+        if item.png_file in deleted:
+            committed.append(converted_image)
+    if committed:
+        append_to_log(committed, log_path, vault_path)
+        print(f"Reclaimed {sum(img.bytes_saved for img in committed) / 1000} KB by re-encoding and "
+              f"{sum(img.deduplicated_size for img in committed) / 1000} KB by removing duplicates.")
+    return deleted, unresolved_files
+
+
+def write_text_atomic(path: Path, content: str) -> None:
+    # hidden temp file next to the note so Obsidian doesn't index it, then swap it in
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    try:
+        tmp_path.write_text(content, encoding="utf-8")
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def parse_reference(match: Match[str]) -> Reference | None:
+    for group in ("link", "angle_link", "wikilink"):
+        raw = match.group(group)
+        if raw is None:
+            continue
+        target = raw.strip()
+        if URL_SCHEME.match(target):
+            # web images are not part of the vault
+            return None
+        if group == "wikilink":
+            # taken literally, the pattern already left out `#heading` and `|size`
+            return Reference(group, target)
+        suffix = LINK_SUFFIX.search(target)
+        path = target[:suffix.start()] if suffix else target
+        # only bare Markdown links are URL encoded, a literal "#" in a name is "%23" there
+        return Reference(group, unquote(path) if group == "link" else path, suffix.group() if suffix else "")
+    return None
+
+
+def resolve_reference(reference: Reference, note: Path, vault_path: Path,
+                      by_name: dict[str, list[Path]]) -> Path | None:
+    """
+    Finds which of the images in `by_name` a reference points at, the way
+    Obsidian does. A path is tried from the note's folder and from the vault
+    root, wikilinks the other way around. A bare name is looked up vault-wide,
+    when several images share it the one next to the note wins. Returns None
+    when nothing matches or the name stays ambiguous.
+    """
+    candidates = by_name.get(reference.name, [])
+    if "/" not in reference.target:
+        if len(candidates) == 1:
+            return candidates[0]
+        return note.parent / reference.name if note.parent / reference.name in candidates else None
+    bases = (vault_path, note.parent) if reference.group == "wikilink" else (note.parent, vault_path)
+    for base in bases:
+        path = Path(os.path.normpath(base / reference.target.lstrip("/")))
+        if path in candidates:
+            return path
+    return None
+
+
+def iter_references(md_content: str) -> Iterator[tuple[Match[str], Reference]]:
+    for match in REFERENCE_PATTERN.finditer(md_content):
+        reference = parse_reference(match)
+        if reference is not None:
+            yield match, reference
 
 
-def replace_image_references(md_content: str, original_name: str, new_name: str) -> str:
-    # Replace all occurrences of original_name with new_name in markdown image/link syntax
-    updated_content = re.sub(rf'(!?\[.*?\]\(.*?){re.escape(original_name)}(.*?\))', rf'\1{new_name}\2', md_content)
-    return updated_content
+def extract_references(md_content: str) -> set[str]:
+    """
+    Returns the file names of every link, embed and wikilink target in a note.
+    Only the name is kept since Obsidian resolves bare names vault-wide.
+    """
+    return {reference.name for _, reference in iter_references(md_content)}
 
-def create_converted_image(img_path: Path) -> ConvertedImage | None:
-    #print("| Filename | Original Size | New Filename | New Size | Date Created | Date Modified |")
-    #print("| -------- | ------------- | ------------ | -------- | ------------ | ------------- |")
-    # date_created : Final[float] = img_path.stat().st_ctime
-    # png_image = pyvips.Image.new_from_file(str(img_path), access="sequential")
-        # 1. Get date_created as Final[datetime]
+
+def replace_image_references(md_content: str, renames: dict[Any, str],
+                             resolve: Callable[[Reference], Any] | None = None) -> tuple[str, set[Any]]:
+    """
+    Rewrites every reference found in `renames` in a single pass over the
+    note, with the same tokenizer that found them. `renames` is keyed by what
+    `resolve` returns for a reference, its file name when there is no `resolve`.
+    A new name containing a "/" is a vault path and replaces the link's folder
+    as well. Returns the new content and the keys that were replaced.
+    """
+    replaced: set[Any] = set()
+    parts: list[str] = []
+    position = 0
+    for match, reference in iter_references(md_content):
+        key = resolve(reference) if resolve is not None else reference.name
+        new_name = renames.get(key)
+        if new_name is None:
+            continue
+        replaced.add(key)
+        if "/" in new_name:
+            new_target = new_name
+        else:
+            folder, _, _ = reference.target.rpartition("/")
+            new_target = f"{folder}/{new_name}" if folder else new_name
+        if reference.group == "link":
+            # keep bare Markdown links valid, they can't hold spaces or parentheses
+            new_target = quote(new_target, safe="/")
+        start, end = match.span(reference.group)
+        parts.append(md_content[position:start])
+        parts.append(new_target + reference.suffix)
+        position = end
+    parts.append(md_content[position:])
+    return "".join(parts), replaced
+
+
+def create_converted_image(img_path: Path, strategies: Iterable[EncodingStrategy] = (STRATEGIES["lossless"],),
+                           min_ssim: float = 0.99, max_dimension: int | None = None,
+                           budget: MemoryBudget | None = None) -> ConvertedImage | None:
+    """
+    Encodes `img_path` with every strategy at once and writes the smallest
+    result that meets `min_ssim`. When nothing beats the PNG itself the
+    returned ConvertedImage has the KEEP_ORIGINAL strategy and nothing is written.
+    """
+    # 1. Get date_created as Final[datetime]
     stat = img_path.stat()
-    date_created: Final[datetime.datetime] = datetime.fromtimestamp(stat.st_birthtime)
+    # st_birthtime only exists on macOS/BSD, fall back to ctime elsewhere
+    date_created: Final[datetime] = datetime.fromtimestamp(getattr(stat, "st_birthtime", stat.st_ctime))
+    original_size = stat.st_size
 
-    # 2. Load the image to vips
+    # 2. Only the header is read here, to know how much memory the trials will need
+    strategies = list(strategies)
     try:
-        png_image = pyvips.Image.new_from_file(str(img_path), access="sequential")
+        header = load_image(img_path, max_dimension)
     except Exception as e:
         print(f"Failed to load image {img_path}: {e}")
         return None
+    estimated_memory = estimate_memory(header, strategies)
+
+    # 3. Run the encoding trials concurrently, each one loads its own copy of the image
+    candidates: list[EncodedCandidate] = []
+    with (budget or MemoryBudget()).reserve(estimated_memory):
+        with ThreadPoolExecutor(max_workers=len(strategies)) as executor:
+            trials = {executor.submit(encode_with_strategy, img_path, strategy, min_ssim, max_dimension): strategy
+                      for strategy in strategies}
+            for trial in as_completed(trials):
+                try:
+                    candidate = trial.result()
+                except Exception as e:
+                    print(f"Failed to encode {img_path} as {trials[trial].name}: {e}")
+                    continue
+                if candidate:
+                    candidates.append(candidate)
+    if not candidates:
+        return None
 
-    # 3. Save the image as a lossless webp using pyvips, change extension to .webp
-    new_path = img_path.with_suffix('.webp')
+    # 4. Keep the smallest candidate, but only if it is smaller than the PNG
+    best = min(candidates, key=lambda candidate: len(candidate.data))
+    if len(best.data) >= original_size:
+        print(f"Keeping {img_path}, the best encoding ({best.strategy.name}) is not smaller")
+        return ConvertedImage(
+            original_path=img_path,
+            new_path=img_path,
+            original_size=original_size,
+            new_size=original_size,
+            date_created=date_created,
+            date_modified=datetime.fromtimestamp(stat.st_mtime),
+            strategy=KEEP_ORIGINAL,
+            estimated_memory=estimated_memory,
+        )
+
+    new_path = img_path.with_suffix(best.strategy.suffix)
     try:
-        png_image.write_to_file(str(new_path), Q=100, lossless=True, strip=False)
+        new_path.write_bytes(best.data)
     except Exception as e:
-        print(f"Failed to save webp for {img_path}: {e}")
+        print(f"Failed to save {best.strategy.suffix} for {img_path}: {e}")
         return None
 
-    # 4. Return the filled out ConvertedImage dataclass
-    original_size = stat.st_size
-    new_stat = new_path.stat() if new_path.exists() else None
-    new_size = new_stat.st_size if new_stat else 0
-    date_modified: Final[datetime] = datetime.fromtimestamp(new_stat.st_mtime)
-
+    # 5. Return the filled out ConvertedImage dataclass
+    new_stat = new_path.stat()
     return ConvertedImage(
         original_path=img_path,
         new_path=new_path,
         original_size=original_size,
-        new_size=new_size,
+        new_size=new_stat.st_size,
         date_created=date_created,
-        date_modified=date_modified,
+        date_modified=datetime.fromtimestamp(new_stat.st_mtime),
+        strategy=best.strategy.name,
+        estimated_memory=estimated_memory,
     )
 
+
+def load_image(img_path: Path, max_dimension: int | None = None, access: str = "sequential") -> pyvips.Image:
+    """
+    Opens an image lazily. With `max_dimension` larger images go through
+    thumbnail, which shrinks while decoding so the full size is never in memory.
+    """
+    if max_dimension:
+        header = pyvips.Image.new_from_file(str(img_path))
+        if max(header.width, header.height) > max_dimension:
+            return pyvips.Image.thumbnail(str(img_path), max_dimension, height=max_dimension, size="down")
+    return pyvips.Image.new_from_file(str(img_path), access=access)
+
+
+def estimate_memory(image: pyvips.Image, strategies: list[EncodingStrategy]) -> int:
+    # the webp/heif encoders want the whole decoded image, SSIM adds about 7 float planes per check
+    pixels = image.width * image.height
+    decoded = pixels * image.bands * (2 if image.format == "ushort" else 1)
+    ssim_checks = sum(1 for strategy in strategies if not strategy.lossless)
+    return len(strategies) * decoded + ssim_checks * pixels * 4 * 7
+
+
+def peak_rss() -> int:
+    # ru_maxrss never goes down, it is the high-water mark of the whole process so far;
+    # it is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def encode_with_strategy(img_path: Path, strategy: EncodingStrategy, min_ssim: float,
+                         max_dimension: int | None = None) -> EncodedCandidate | None:
+    if strategy.lossless:
+        return EncodedCandidate(strategy, encode_image(img_path, strategy, max_dimension), None)
+    if not strategy.search_quality:
+        data = encode_image(img_path, strategy, max_dimension)
+        score = measure_ssim(img_path, data, max_dimension)
+        return EncodedCandidate(strategy, data, score) if score >= min_ssim else None
+
+    # binary search for the lowest Q that still meets the SSIM bound
+    best: EncodedCandidate | None = None
+    low, high = 0, len(QUALITY_STEPS) - 1
+    while low <= high:
+        middle = (low + high) // 2
+        data = encode_image(img_path, strategy, max_dimension, Q=QUALITY_STEPS[middle])
+        score = measure_ssim(img_path, data, max_dimension)
+        if score >= min_ssim:
+            best = EncodedCandidate(strategy, data, score)
+            high = middle - 1
+        else:
+            low = middle + 1
+    return best
+
+
+def encode_image(img_path: Path, strategy: EncodingStrategy, max_dimension: int | None = None, **options: Any) -> bytes:
+    png_image = load_image(img_path, max_dimension)
+    return png_image.write_to_buffer(strategy.suffix, **(strategy.options | options))
+
+
+def measure_ssim(img_path: Path, data: bytes, max_dimension: int | None = None) -> float:
+    """
+    Mean structural similarity of the luminance of `data` against the original,
+    computed with libvips operators using the usual 1.5 sigma gaussian window.
+    """
+    def luminance(image: pyvips.Image) -> pyvips.Image:
+        grey = image.colourspace("b-w")[0]
+        if grey.format == "ushort":
+            grey = grey / 257
+        return grey.cast("float")
+
+    original = luminance(load_image(img_path, max_dimension, access="random"))
+    encoded = luminance(pyvips.Image.new_from_buffer(data, ""))
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mu_x, mu_y = original.gaussblur(1.5), encoded.gaussblur(1.5)
+    sigma_xx = (original * original).gaussblur(1.5) - mu_x * mu_x
+    sigma_yy = (encoded * encoded).gaussblur(1.5) - mu_y * mu_y
+    sigma_xy = (original * encoded).gaussblur(1.5) - mu_x * mu_y
+    ssim_map = (((2 * mu_x * mu_y + c1) * (2 * sigma_xy + c2))
+                / ((mu_x * mu_x + mu_y * mu_y + c1) * (sigma_xx + sigma_yy + c2)))
+    return ssim_map.avg()
+
+
 def append_to_log(converted_images: list[ConvertedImage], log_path: Path, relative_path: Path = Path("/")) -> None:
     with log_path.open("a", encoding="utf-8") as log_file:
         for img in converted_images:
-            # todo - fix relative path
-            # | Filename | Original Size | New Filename | New Size | Date Created | Date Modified |
-            log_file.write(f"|{img.original_path.relative_to(relative_path)} | {img.original_size / 1000} KB | {img.new_path.relative_to(relative_path)} | {img.new_size / 1000} KB | {img.date_created.isoformat()} | {img.date_modified.isoformat()} |\n")
+            # | Filename | Original Size | New Filename | New Size | Date Created | Date Modified | Strategy | Saved | Deduplicated |
+            log_file.write(f"|{img.original_path.relative_to(relative_path)} | {img.original_size / 1000} KB | {img.new_path.relative_to(relative_path)} | {img.new_size / 1000} KB | {img.date_created.isoformat()} | {img.date_modified.isoformat()} | {img.strategy} | {img.bytes_saved / 1000} KB | {img.deduplicated_size / 1000} KB |\n")
 
 
 if __name__ == "__main__":
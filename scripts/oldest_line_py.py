@@ -5,37 +5,465 @@
 # ]
 # ///
 import os
-import sys
+import argparse
+import heapq
+import pickle
+import sqlite3
 import subprocess
+import sys
+import time
+import zlib
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, as_completed, wait
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import IO, Callable, Iterator, TypeVar
 from tqdm import tqdm
 
-def find_files(directory) -> iter:
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if 'node_modules' in root or '.git' in root:
-                continue
-            file_path = os.path.join(root, file)
+T = TypeVar('T')
+
+# git's own buffer_is_binary() only looks at the first 8000 bytes
+BINARY_SNIFF_BYTES = 8000
+EXCLUDED_PATHSPECS = (':(exclude,glob)**/node_modules/**',)
+
+
+@dataclass(frozen=True, slots=True)
+class CommitInfo:
+    sha: str
+    author: str
+    author_time: int
+    author_tz: timezone
+
+
+@dataclass(frozen=True, slots=True)
+class BlameLine:
+    path: str
+    line_number: int
+    commit: CommitInfo
+    content: str
+
+    def __str__(self) -> str:
+        date = datetime.fromtimestamp(self.commit.author_time, self.commit.author_tz)
+        return (f"{self.commit.sha[:8]} {self.path} "
+                f"({self.commit.author} {date:%Y%m%d} {self.line_number}) {self.content}")
+
+
+def parse_tz(offset: str) -> timezone:
+    # git writes author-tz as [+-]HHMM
+    try:
+        sign = -1 if offset.startswith('-') else 1
+        return timezone(sign * timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5])))
+    except (ValueError, IndexError):
+        return timezone.utc
+
+
+def git_output(directory, *args: str) -> str | None:
+    try:
+        output = subprocess.check_output(['git', *args], cwd=directory, stderr=subprocess.DEVNULL)
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+    return output.decode('utf-8', errors='surrogateescape')
+
+
+def tracked_files(directory) -> dict[str, str]:
+    """
+    Maps every tracked file under `directory` to its blob OID with a single
+    `ls-files` call instead of `--error-unmatch` per file. Paths come back
+    relative to `directory`, NUL separated so odd names survive.
+    `node_modules` is excluded by pathspec so git never descends into it.
+    """
+    output = git_output(directory, 'ls-files', '-z', '--stage', '--', '.', *EXCLUDED_PATHSPECS)
+    if output is None:
+        return {}
+    files: dict[str, str] = {}
+    for entry in output.split('\0'):
+        # <mode> <oid> <stage>\t<path>
+        info, _, path = entry.partition('\t')
+        mode, oid, _ = info.split(' ', 2) if path else ('', '', '')
+        # 160000 is a submodule commit, there's nothing to blame
+        if path and mode != '160000':
+            files[path] = oid
+    return files
+
+
+def text_attributes(directory, files: list[str]) -> dict[str, bool]:
+    """
+    Looks up the `diff` and `text` attributes for all `files` in one
+    `check-attr --stdin` call. Returns True for files .gitattributes marks as
+    text (`diff`/`text` set), False for `binary`/`-diff`/`-text`, and leaves the
+    others out so their content gets sniffed instead. `text=auto` is one of those,
+    it asks git to decide from the content too.
+    """
+    try:
+        result = subprocess.run(['git', 'check-attr', '-z', '--stdin', 'diff', 'text'], cwd=directory,
+                                input='\0'.join(files).encode('utf-8', errors='surrogateescape'),
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return {}
+    fields = result.stdout.decode('utf-8', errors='surrogateescape').split('\0')
+    values: dict[str, dict[str, str]] = {}
+    # <path> NUL <attribute> NUL <info> NUL, once per path and attribute
+    for path, attribute, info in zip(fields[0::3], fields[1::3], fields[2::3]):
+        values.setdefault(path, {})[attribute] = info
+    attributes: dict[str, bool] = {}
+    for path, info in values.items():
+        # an explicit diff setting wins over text, like it does for `git diff`
+        for attribute in ('diff', 'text'):
+            if info.get(attribute) in ('set', 'unset'):
+                attributes[path] = info[attribute] == 'set'
+                break
+    return attributes
+
+
+def is_binary(file_path: str) -> bool:
+    # same heuristic as git: a NUL byte within the first few KB, never the whole file
+    with open(file_path, 'rb') as f:
+        return b'\0' in f.read(BINARY_SNIFF_BYTES)
+
+
+def dirty_files(directory) -> set[str]:
+    # files whose worktree or index differs from HEAD, their blob OID can't be trusted
+    output = git_output(directory, 'diff', '--name-only', '--relative', '-z', 'HEAD')
+    return set(path for path in (output or '').split('\0') if path)
+
+
+def find_files(directory, tracked: dict[str, str]) -> Iterator[str]:
+    files = list(tracked)
+    attributes = text_attributes(directory, files)
+    for file in files:
+        is_text = attributes.get(file)
+        if is_text is None:
             try:
-                with open(file_path, 'rb') as f:
-                    if b'\0' in f.read():
-                        continue
-            except:
+                is_text = not is_binary(os.path.join(directory, file))
+            except OSError:
                 continue
-            yield file_path
+        if is_text:
+            yield file
 
-def main(directory):
-    files = list(find_files(directory))
-    for file in tqdm(files, desc="Processing files"):
-        try:
-            subprocess.check_output(['git', 'ls-files', '--error-unmatch', file], stderr=subprocess.STDOUT)
-            blame_output = subprocess.check_output(['git', 'blame', '--date=format:%Y%m%d', '-f', file])
-            blame_lines = blame_output.decode('utf-8').splitlines()
-            for line in blame_lines:
-                if '20' in line:
-                    print(line)
-        except subprocess.CalledProcessError:
+
+def parse_porcelain(stream: IO[bytes], path: str) -> Iterator[BlameLine]:
+    """
+    Parses `git blame --porcelain` output. Commit metadata is only emitted the
+    first time a commit shows up, so it is parsed once and reused for every
+    following line of that commit.
+    """
+    commits: dict[str, CommitInfo] = {}
+    pending: dict[str, str] = {}
+    sha = ''
+    line_number = 0
+    for raw in stream:
+        line = raw.decode('utf-8', errors='replace').rstrip('\n')
+        if line.startswith('\t'):
+            commit = commits.get(sha)
+            if commit is None:
+                commit = CommitInfo(
+                    sha=sha,
+                    author=pending.get('author', ''),
+                    author_time=int(pending.get('author-time', 0)),
+                    author_tz=parse_tz(pending.get('author-tz', '+0000')),
+                )
+                commits[sha] = commit
+                pending = {}
+            yield BlameLine(path, line_number, commit, line[1:])
             continue
+        key, _, value = line.partition(' ')
+        if len(key) == 40 and value[:1].isdigit():
+            # header: <sha> <orig line> <final line> [<lines in group>]
+            sha = key
+            line_number = int(value.split(' ')[1])
+        elif sha not in commits:
+            pending[key] = value
+
+
+def blame_file(file: str, directory) -> Iterator[BlameLine]:
+    with subprocess.Popen(['git', 'blame', '--porcelain', '--', file], cwd=directory,
+                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as process:
+        yield from parse_porcelain(process.stdout, file)
+
+
+def blame_lines(file: str, directory, since: int) -> list[BlameLine]:
+    return [line for line in blame_file(file, directory) if line.commit.author_time >= since]
+
+
+class OldestLines:
+    """
+    Keeps the `k` oldest lines pushed into it in a fixed-size max-heap keyed on
+    author-time, so memory stays O(k) however many lines go through it.
+    """
+
+    def __init__(self, k: int):
+        self.k = k
+        self._heap: list[tuple[int, int, BlameLine]] = []
+        self._pushed = 0
+
+    def push(self, line: BlameLine) -> None:
+        # negated so heap[0] is the newest line kept, i.e. the next to evict
+        entry = (-line.commit.author_time, self._pushed, line)
+        self._pushed += 1
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        elif entry[0] > self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def lines(self) -> list[BlameLine]:
+        return sorted((entry[2] for entry in self._heap), key=lambda line: line.commit.author_time)
+
+
+@dataclass(slots=True)
+class Rollup:
+    lines: int
+    oldest: BlameLine
+
+    def add(self, line: BlameLine, count: int = 1) -> None:
+        self.lines += count
+        if line.commit.author_time < self.oldest.commit.author_time:
+            self.oldest = line
+
+    def merge(self, other: 'Rollup') -> None:
+        self.add(other.oldest, other.lines)
+
+
+@dataclass(slots=True)
+class FileSummary:
+    path: str
+    oldest: list[BlameLine]
+    total: Rollup | None
+    authors: dict[str, Rollup]
+
+
+def add_to_rollups(rollups: dict[str, Rollup], key: str, rollup: Rollup) -> None:
+    existing = rollups.get(key)
+    if existing is None:
+        rollups[key] = Rollup(rollup.lines, rollup.oldest)
+    else:
+        existing.merge(rollup)
+
+
+def summarize_file(file: str, directory, since: int, top: int) -> FileSummary:
+    # Only the file's `top` oldest lines and its per-author rollups leave the
+    # worker, the full blame is never materialized.
+    oldest = OldestLines(top)
+    total: Rollup | None = None
+    authors: dict[str, Rollup] = {}
+    for line in blame_file(file, directory):
+        if line.commit.author_time < since:
+            continue
+        oldest.push(line)
+        if total is None:
+            total = Rollup(1, line)
+        else:
+            total.add(line)
+        author = authors.get(line.commit.author)
+        if author is None:
+            authors[line.commit.author] = Rollup(1, line)
+        else:
+            author.add(line)
+    return FileSummary(file, oldest.lines(), total, authors)
+
+
+def map_files(task: Callable[[str], T], files: list[str], jobs: int = 1, ordered: bool = False) -> Iterator[T]:
+    """
+    Runs `task` over `files` and yields each result as soon as it is ready.
+    With more than one job the work is fanned out to a process pool; at most
+    `jobs * 4` files are in flight so results never pile up in memory.
+    `ordered` keeps the input order by waiting on the oldest submission first.
+    """
+    if jobs <= 1:
+        for file in files:
+            yield task(file)
+        return
+    max_in_flight = jobs * 4
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        if ordered:
+            window: deque[Future[T]] = deque()
+            for file in files:
+                if len(window) >= max_in_flight:
+                    yield window.popleft().result()
+                window.append(executor.submit(task, file))
+            while window:
+                yield window.popleft().result()
+        else:
+            in_flight: set[Future[T]] = set()
+            for file in files:
+                if len(in_flight) >= max_in_flight:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                in_flight.add(executor.submit(task, file))
+            for future in as_completed(in_flight):
+                yield future.result()
+
+
+def print_rollups(title: str, rollups: dict[str, Rollup]) -> None:
+    print(f"\n{title}:")
+    for key, rollup in sorted(rollups.items(), key=lambda item: item[1].oldest.commit.author_time):
+        date = datetime.fromtimestamp(rollup.oldest.commit.author_time, rollup.oldest.commit.author_tz)
+        print(f"{date:%Y%m%d}\t{rollup.lines:>8}\t{key}\t{rollup.oldest.path}:{rollup.oldest.line_number}")
+
+
+class BlameCache:
+    """
+    Per-file `--top` summaries stored in SQLite under the repo's `.git` folder,
+    keyed by path and blob OID. A row is only trusted while the HEAD it was
+    computed at is still reachable from the current HEAD, so unchanged blobs
+    skip `git blame` on later runs. The least recently used rows are evicted
+    once the cache grows past `max_bytes`.
+    """
+    SCHEMA_VERSION = 1
+
+    def __init__(self, path: str, head: str, since: int, top: int, max_bytes: int):
+        self.head = head
+        self.since = since
+        self.top = top
+        self.max_bytes = max_bytes
+        self.now = int(time.time())
+        self._hits: list[tuple[int, str, str, int, int]] = []
+        self.db = sqlite3.connect(path)
+        if self.db.execute('PRAGMA user_version').fetchone()[0] != self.SCHEMA_VERSION:
+            self.db.execute('DROP TABLE IF EXISTS summaries')
+            self.db.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS summaries (
+            path TEXT NOT NULL,
+            oid TEXT NOT NULL,
+            since INTEGER NOT NULL,
+            top INTEGER NOT NULL,
+            head TEXT NOT NULL,
+            summary BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            last_used INTEGER NOT NULL,
+            PRIMARY KEY (path, oid, since, top)
+        )''')
+
+    @classmethod
+    def open(cls, directory, since: int, top: int, max_bytes: int) -> 'BlameCache | None':
+        git_dir = git_output(directory, 'rev-parse', '--path-format=absolute', '--git-common-dir')
+        head = git_output(directory, 'rev-parse', 'HEAD')
+        if git_dir is None or head is None:
+            return None
+        cache = cls(os.path.join(git_dir.strip(), 'oldest_line_cache.sqlite'), head.strip(), since, top, max_bytes)
+        cache.drop_unreachable(directory)
+        return cache
+
+    def drop_unreachable(self, directory) -> None:
+        # history was rewritten under these rows (rebase, reset), their blame may be wrong
+        heads = [row[0] for row in self.db.execute('SELECT DISTINCT head FROM summaries')]
+        for head in heads:
+            if head != self.head and git_output(directory, 'merge-base', '--is-ancestor', head, self.head) is None:
+                self.db.execute('DELETE FROM summaries WHERE head = ?', (head,))
+        self.db.commit()
+
+    def get(self, path: str, oid: str) -> 'FileSummary | None':
+        row = self.db.execute('SELECT summary FROM summaries WHERE path = ? AND oid = ? AND since = ? AND top = ?',
+                              (path, oid, self.since, self.top)).fetchone()
+        if row is None:
+            return None
+        try:
+            summary = pickle.loads(zlib.decompress(row[0]))
+        except Exception:
+            return None
+        self._hits.append((self.now, path, oid, self.since, self.top))
+        return summary
+
+    def put(self, path: str, oid: str, summary: 'FileSummary') -> None:
+        blob = zlib.compress(pickle.dumps(summary, pickle.HIGHEST_PROTOCOL))
+        self.db.execute('INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (path, oid, self.since, self.top, self.head, blob, len(blob), self.now))
+
+    def close(self) -> None:
+        self.db.executemany('UPDATE summaries SET last_used = ? WHERE path = ? AND oid = ? AND since = ? AND top = ?',
+                            self._hits)
+        self.db.execute('''DELETE FROM summaries WHERE rowid IN (
+            SELECT rowid FROM (
+                SELECT rowid, SUM(size) OVER (ORDER BY last_used DESC, rowid DESC) AS used FROM summaries
+            ) WHERE used > ?
+        )''', (self.max_bytes,))
+        self.db.commit()
+        self.db.close()
+
+
+def parse_date(value: str) -> int:
+    date = datetime.fromisoformat(value)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return int(date.timestamp())
+
+
+def main(directory, since: int, jobs: int = 1, ordered: bool = False,
+         top: int = 0, by_directory: bool = False, by_author: bool = False,
+         use_cache: bool = True, cache_size: int = 256 * 1024 * 1024):
+    tracked = tracked_files(directory)
+    files = list(find_files(directory, tracked))
+    if top <= 0:
+        task = partial(blame_lines, directory=directory, since=since)
+        for lines in tqdm(map_files(task, files, jobs, ordered), total=len(files), desc="Processing files"):
+            for line in lines:
+                print(line)
+        return
+
+    oldest = OldestLines(top)
+    directories: dict[str, Rollup] = {}
+    authors: dict[str, Rollup] = {}
+
+    def collect(summary: FileSummary) -> None:
+        for line in summary.oldest:
+            oldest.push(line)
+        if by_directory and summary.total is not None:
+            add_to_rollups(directories, os.path.dirname(summary.path) or '.', summary.total)
+        if by_author:
+            for author, rollup in summary.authors.items():
+                add_to_rollups(authors, author, rollup)
+
+    cache = BlameCache.open(directory, since, top, cache_size) if use_cache else None
+    dirty = dirty_files(directory) if cache else set()
+    to_blame: list[str] = []
+    for file in files:
+        summary = cache.get(file, tracked[file]) if cache and file not in dirty else None
+        if summary is None:
+            to_blame.append(file)
+        else:
+            collect(summary)
+    if cache and len(to_blame) < len(files):
+        print(f"Reused {len(files) - len(to_blame)} cached file(s)", file=sys.stderr)
+
+    task = partial(summarize_file, directory=directory, since=since, top=top)
+    try:
+        for summary in tqdm(map_files(task, to_blame, jobs), total=len(to_blame), desc="Processing files"):
+            collect(summary)
+            if cache and summary.path not in dirty:
+                cache.put(summary.path, tracked[summary.path], summary)
+    finally:
+        if cache:
+            cache.close()
+    for line in oldest.lines():
+        print(line)
+    if by_directory:
+        print_rollups("By directory", directories)
+    if by_author:
+        print_rollups("By author", authors)
+
 
 if __name__ == "__main__":
-    directory = sys.argv[1] if len(sys.argv) > 1 else os.getcwd()
-    main(directory)
+    parser = argparse.ArgumentParser(description="Blame every tracked text file and print its lines.")
+    parser.add_argument("directory", nargs="?", default=os.getcwd(),
+                        help="directory to scan (default: current directory)")
+    parser.add_argument("--since", type=parse_date, default="2000-01-01",
+                        help="only print lines authored on or after this ISO date (default: 2000-01-01)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of blame processes to run in parallel, 0 for one per CPU (default: 1)")
+    parser.add_argument("--ordered", action="store_true",
+                        help="with --jobs, print files in path order instead of as they finish")
+    parser.add_argument("--top", type=int, default=0, metavar="K",
+                        help="only print the K oldest lines across all files")
+    parser.add_argument("--by-directory", action="store_true",
+                        help="with --top, also print line count and oldest line per directory")
+    parser.add_argument("--by-author", action="store_true",
+                        help="with --top, also print line count and oldest line per author")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="with --top, don't read or write the blame cache in .git/oldest_line_cache.sqlite")
+    parser.add_argument("--cache-size", type=int, default=256, metavar="MB",
+                        help="evict least recently used cache entries above this size (default: 256)")
+    args = parser.parse_args()
+    main(args.directory, args.since, args.jobs or os.cpu_count() or 1, args.ordered,
+         args.top, args.by_directory, args.by_author,
+         not args.no_cache, args.cache_size * 1024 * 1024)
@@ -0,0 +1,763 @@
+#!/usr/bin/env -S uv run --script
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#   "gitpython~=3.1.45",
+#   "PyGithub~=2.8.1",
+#   "tqdm~=4.67.1",
+#   "requests-cache~=1.2.1",
+#   "colorlog~=6.10.1",
+#   "sourcetypes3~=0.1.0",
+# ]
+# ///
+"""
+Benchmarks git-branch-cleanup.py offline, against a local stand-in for the GitHub API.
+
+Usage:
+  ./scripts/python/benchmark-git-branch-cleanup.py --prs 2000 --branches 500 --output before.json
+  ./scripts/python/benchmark-git-branch-cleanup.py --prs 2000 --branches 500 --compare before.json
+  ./scripts/python/benchmark-git-branch-cleanup.py --serve --port 8765
+  ./scripts/python/benchmark-git-branch-cleanup.py --record fixtures/ --repo owner/name
+  ./scripts/python/benchmark-git-branch-cleanup.py --replay fixtures/ --repo owner/name
+
+The stand-in answers the GraphQL queries and mutations of git-branch-cleanup.py and the REST
+git refs endpoints, for synthetic repositories with --prs merged pull requests whose branches are
+partly left over. --latency and --rate-limit-every make it answer like a busy api.github.com.
+Each phase reports its wall time, the pages fetched per query and the bytes sent and received.
+
+--record proxies the read-only requests to api.github.com and saves every answer in a folder,
+--replay serves them again so a real repository can be benchmarked offline. --serve only runs
+the stand-in: GITHUB_API_URL=http://127.0.0.1:8765 GITHUB_TOKEN=x ./git-branch-cleanup.py bench/repo0
+"""
+from contextlib import redirect_stdout
+from dataclasses import asdict, dataclass, field
+from functools import cached_property
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import argparse
+import hashlib
+import importlib.metadata
+import importlib.util
+import io
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import types
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Any, Callable
+
+
+def load_cleanup() -> types.ModuleType:
+    spec = importlib.util.spec_from_file_location(
+        "git_branch_cleanup", Path(__file__).resolve().parent / "git-branch-cleanup.py")
+    module = importlib.util.module_from_spec(spec)
+    # the dataclasses of the module look it up in sys.modules while it loads
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+cleanup = load_cleanup()
+
+ZERO_OID = "0" * 40
+RATE_LIMIT_BUDGET = 5000
+SECONDARY_RATE_LIMIT = {
+    "message": "You have exceeded a secondary rate limit. Please wait a few minutes before you try again.",
+    "documentation_url": "https://docs.github.com/rest/overview/rate-limits-for-the-rest-api",
+}
+
+
+@dataclass
+class RepositorySpec:
+    repos: int = 1
+    prs: int = 2000
+    branches: int = 500
+    open_branches: int = 50
+    moved: float = 0.1
+    seed: int = 0
+
+
+@dataclass
+class Faults:
+    latency: float = 0.0
+    rate_limit_every: int = 0
+    retry_after: int = 1
+
+
+@dataclass
+class Response:
+    status: int
+    body: bytes = b""
+    headers: dict[str, str] = field(default_factory=dict)
+    kind: str = "rest"
+
+    @classmethod
+    def json(cls, status: int, payload: Any, kind: str = "rest", **headers: str) -> "Response":
+        return cls(status, json.dumps(payload).encode(), {"Content-Type": "application/json; charset=utf-8", **headers},
+                   kind)
+
+
+@dataclass
+class Traffic:
+    """
+    What went over the wire during one phase, pages are counted per kind of query.
+    """
+    requests: int = 0
+    pages: dict[str, int] = field(default_factory=dict)
+    bytes_received: int = 0
+    bytes_sent: int = 0
+    rate_limited: int = 0
+
+
+def query_kind(query: str) -> str:
+    # matches the queries of git-branch-cleanup.py, not GraphQL in general
+    if re.search(r"\bmutation\b", query):
+        return "mutation"
+    if "organization(" in query:
+        return "repositories"
+    if "ref(qualifiedName:" in query:
+        return "branch_lookup"
+    if "merged_pull_requests:" in query:
+        return "branch_merges"
+    if "associatedPullRequests" in query:
+        return "branches"
+    if re.search(r"pullRequests\(\s*first", query):
+        return "pull_requests"
+    if re.search(r"refs\(\s*refPrefix: \"refs/heads/\"\s*first", query):
+        return "branch_tips"
+    if "repository(" in query:
+        return "repository"
+    if "viewer {" in query:
+        return "viewer"
+    return "unknown"
+
+
+def object_id(text: str) -> str:
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def iso(date: datetime) -> str:
+    return date.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+@dataclass
+class FakeRepository:
+    id: str
+    owner: str
+    name: str
+    # pull_request fragment nodes with their updatedAt, newest update first
+    pull_requests: list[dict[str, Any]]
+    # branch name to {"id", "oid"}
+    branches: dict[str, dict[str, str]]
+    default_branch: str = "main"
+
+    @property
+    def full_name(self) -> str:
+        return f"{self.owner}/{self.name}"
+
+    @cached_property
+    def heads(self) -> dict[str, dict[str, Any]]:
+        """
+        The newest merged pull request of every branch name.
+        """
+        return {pull_request["headRefName"]: pull_request for pull_request in reversed(self.pull_requests)}
+
+
+def generate_repository(owner: str, name: str, spec: RepositorySpec, rng: random.Random) -> FakeRepository:
+    """
+    Creates `spec.prs` merged pull requests, keeps the branches of `spec.branches` of them, a
+    `spec.moved` share of those got pushed to after the merge, plus `spec.open_branches` branches
+    that never had a pull request.
+    """
+    repository_id = f"R_{owner}_{name}"
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    pull_requests = []
+    for number in range(1, spec.prs + 1):
+        merged_at = base + timedelta(hours=number)
+        head = object_id(f"{owner}/{name}/head/{number}")
+        pull_requests.append({
+            "number": number,
+            "title": f"Change number {number}",
+            "headRefName": f"feature/{number:05}",
+            "mergeCommit": {"oid": object_id(f"{owner}/{name}/merge/{number}"), "committedDate": iso(merged_at),
+                            "authoredDate": iso(merged_at)},
+            "last_commits": {"totalCount": 3, "nodes": [{"commit": {
+                "oid": head, "committedDate": iso(merged_at - timedelta(hours=1)),
+                "authoredDate": iso(merged_at - timedelta(hours=1))}}]},
+            "merged": True,
+            "isCrossRepository": False,
+            "viewerCanDeleteHeadRef": True,
+            "http_url": f"https://github.com/{owner}/{name}/pull/{number}",
+            "user": {"login": "octocat"},
+            "updatedAt": iso(merged_at + timedelta(minutes=1)),
+        })
+    pull_requests.reverse()
+
+    branches = {"main": {"id": f"REF_{repository_id}_main", "oid": object_id(f"{owner}/{name}/main")}}
+    for pull_request in rng.sample(pull_requests, min(spec.branches, len(pull_requests))):
+        head = pull_request["last_commits"]["nodes"][0]["commit"]["oid"]
+        if rng.random() < spec.moved:
+            head = object_id(f"{head}/pushed")
+        branches[pull_request["headRefName"]] = {"id": f"REF_{repository_id}_{pull_request['number']}", "oid": head}
+    for i in range(spec.open_branches):
+        branches[f"wip/{i:05}"] = {"id": f"REF_{repository_id}_wip_{i}", "oid": object_id(f"{owner}/{name}/wip/{i}")}
+    return FakeRepository(repository_id, owner, name, pull_requests, branches)
+
+
+class SyntheticGitHub:
+    """
+    Serves generated repositories: the queries of git-branch-cleanup.py with their
+    connections and `rateLimit`, the `deleteRef`/`updateRefs` mutations and the REST
+    `git/refs/heads` endpoints. Deleted branches stay deleted until `reset`.
+    """
+    OWNER = "bench"
+
+    def __init__(self, spec: RepositorySpec):
+        self.spec = spec
+        self.lock = threading.Lock()
+        # the headers of the request being handled, set per thread by StandInHandler
+        self.headers = threading.local()
+        self.reset()
+
+    def reset(self) -> None:
+        rng = random.Random(self.spec.seed)
+        with self.lock:
+            self.repositories = {repository.full_name: repository for repository in (
+                generate_repository(self.OWNER, f"repo{i}", self.spec, rng) for i in range(self.spec.repos))}
+            self.by_id = {repository.id: repository for repository in self.repositories.values()}
+            self.spent = 0
+
+    @property
+    def repository_names(self) -> list[str]:
+        return list(self.repositories)
+
+    def move_branches(self, count: int) -> None:
+        """
+        Pushes to `count` branches of merged pull requests, a plan written before no longer matches them.
+        """
+        with self.lock:
+            for repository in self.repositories.values():
+                names = sorted(name for name in repository.branches if name.startswith("feature/"))
+                for name in names[:count]:
+                    repository.branches[name]["oid"] = object_id(repository.branches[name]["oid"])
+
+    def handle(self, method: str, path: str, body: bytes) -> Response:
+        if method == "POST" and path.endswith("graphql"):
+            request = json.loads(body)
+            with self.lock:
+                return self.graphql(request["query"], request.get("variables") or {})
+        match = re.fullmatch(r"(?:/api/v3)?/repos/([^/]+)/([^/]+)/git/refs?/heads/(.+)", path)
+        if match and method in ("GET", "DELETE"):
+            owner, name, branch = (urllib.parse.unquote(part) for part in match.groups())
+            with self.lock:
+                return self.rest_ref(method, f"{owner}/{name}", branch)
+        return Response.json(404, {"message": "Not Found"})
+
+    def rest_ref(self, method: str, full_name: str, branch: str) -> Response:
+        repository = self.repositories.get(full_name)
+        ref = repository.branches.get(branch) if repository else None
+        if ref is None:
+            return Response.json(404 if method == "GET" else 422, {"message": "Reference does not exist"})
+        if method == "DELETE":
+            del repository.branches[branch]
+            return Response(204)
+        return Response.json(200, {
+            "ref": f"refs/heads/{branch}",
+            "node_id": ref["id"],
+            "url": f"/repos/{full_name}/git/refs/heads/{branch}",
+            "object": {"sha": ref["oid"], "type": "commit", "url": f"/repos/{full_name}/git/commits/{ref['oid']}"},
+        })
+
+    def graphql(self, query: str, variables: dict[str, Any]) -> Response:
+        kind = query_kind(query)
+        if kind == "mutation":
+            accept = {key.lower(): value for key, value in getattr(self.headers, "value", {}).items()}.get("accept", "")
+            if "updateRefs(" in query and "update-refs-preview" not in accept:
+                # what GitHub answers when the schema preview wasn't asked for
+                return Response.json(200, {"errors": [{
+                    "path": ["mutation DeleteRefs", "delete0"], "extensions": {
+                        "code": "undefinedField", "typeName": "Mutation", "fieldName": "updateRefs"},
+                    "message": "Field 'updateRefs' doesn't exist on type 'Mutation'"}]}, kind)
+            return Response.json(200, self.mutate(query, variables), kind)
+        if variables.get("first", 0) > 100:
+            return Response.json(200, {"data": None, "errors": [{
+                "type": "EXCESSIVE_PAGINATION", "message": "Requesting more than 100 records is not allowed."}]}, kind)
+        if kind == "viewer":
+            return self.page(kind, {"viewer": {"login": self.OWNER}}, {"first": 1})
+        if kind == "repositories":
+            if variables["org"] != self.OWNER:
+                return self.not_found(kind, "organization", f"Could not resolve to an Organization with the login of '{variables['org']}'.")
+            nodes = [self.overview(repository) for repository in self.repositories.values()]
+            return self.page(kind, {"organization": {"repositories": self.connection(nodes, variables)}}, variables)
+        repository = self.repositories.get(f"{variables.get('owner')}/{variables.get('repo')}")
+        if repository is None:
+            return self.not_found(kind, "repository", f"Could not resolve to a Repository with the name "
+                                                      f"'{variables.get('owner')}/{variables.get('repo')}'.")
+        if kind == "repository":
+            return self.page(kind, {"repository": self.overview(repository)}, {"first": 1})
+        if kind == "pull_requests":
+            nodes = repository.pull_requests
+            return self.page(kind, {"repository": {"pullRequests": self.connection(nodes, variables)}}, variables)
+        if kind in ("branches", "branch_tips", "branch_merges"):
+            nodes = [self.ref(repository, name, kind) for name in sorted(repository.branches)]
+            return self.page(kind, {"repository": {"refs": self.connection(nodes, variables)}}, variables)
+        if kind == "branch_lookup":
+            refs = {key[len("ref"):]: value for key, value in variables.items() if re.fullmatch(r"ref\d+", key)}
+            found = {f"b{i}": self.ref(repository, name.removeprefix("refs/heads/"), "branches")
+                          if name.removeprefix("refs/heads/") in repository.branches else None
+                     for i, name in refs.items()}
+            return self.page(kind, {"repository": found}, {"first": len(refs)})
+        return Response.json(200, {"data": None, "errors": [{"message": "Query not supported by the stand-in."}]}, kind)
+
+    @staticmethod
+    def ref(repository: FakeRepository, name: str, kind: str) -> dict[str, Any]:
+        node = {"id": repository.branches[name]["id"], "name": name,
+                "target": {"oid": repository.branches[name]["oid"]}}
+        pull_request = repository.heads.get(name)
+        if kind == "branches":
+            node["associatedPullRequests"] = {"nodes": [
+                {key: value for key, value in pull_request.items() if key != "updatedAt"}] if pull_request else []}
+        elif kind == "branch_merges":
+            node["merged_pull_requests"] = {"nodes": [
+                {key: pull_request[key] for key in ("number", "title", "headRefName", "mergeCommit", "merged",
+                                                    "isCrossRepository", "viewerCanDeleteHeadRef", "http_url")}] if pull_request else []}
+        return node
+
+    @staticmethod
+    def not_found(kind: str, key: str, message: str) -> Response:
+        return Response.json(200, {"data": {key: None}, "errors": [{"type": "NOT_FOUND", "path": [key],
+                                                                     "message": message}]}, kind)
+
+    @staticmethod
+    def connection(nodes: list[dict[str, Any]], variables: dict[str, Any]) -> dict[str, Any]:
+        start = int(variables.get("after") or 0)
+        page = nodes[start:start + variables["first"]]
+        end = start + len(page)
+        return {"totalCount": len(nodes), "pageInfo": {"endCursor": str(end), "hasNextPage": end < len(nodes)},
+                "nodes": page}
+
+    def page(self, kind: str, data: dict[str, Any], variables: dict[str, Any]) -> Response:
+        # roughly GitHub's cost: one point per hundred nodes, nested connections included
+        cost = max(1, variables["first"] * (3 if kind in ("branches", "branch_lookup") else 1) // 100)
+        self.spent += cost
+        reset_at = datetime.now(tz=timezone.utc).replace(microsecond=0) + timedelta(hours=1)
+        data["rateLimit"] = {"cost": cost, "remaining": max(0, RATE_LIMIT_BUDGET - self.spent),
+                             "resetAt": iso(reset_at)}
+        return Response.json(200, {"data": data}, kind)
+
+    @staticmethod
+    def overview(repository: FakeRepository) -> dict[str, Any]:
+        return {
+            "id": repository.id,
+            "nameWithOwner": repository.full_name,
+            "url": f"https://github.com/{repository.full_name}",
+            "defaultBranchRef": {"name": repository.default_branch},
+            "viewerPermission": "ADMIN",
+            "openPullRequests": {"totalCount": 0},
+            "branches": {"totalCount": len(repository.branches)},
+        }
+
+    def mutate(self, query: str, variables: dict[str, Any]) -> dict[str, Any]:
+        data: dict[str, Any] = {}
+        errors: list[dict[str, Any]] = []
+        for alias, mutation, variable in re.findall(r"(\w+):\s*(deleteRef|updateRefs)\(input:\s*\$(\w+)\)", query):
+            error = self.delete_ref(variables[variable]) if mutation == "deleteRef" \
+                else self.update_refs(variables[variable])
+            if error is None:
+                data[alias] = {"clientMutationId": None}
+            else:
+                data[alias] = None
+                errors.append({**error, "path": [alias]})
+        return {"data": data, **({"errors": errors} if errors else {})}
+
+    def delete_ref(self, mutation_input: dict[str, Any]) -> dict[str, str] | None:
+        for repository in self.repositories.values():
+            for name, ref in repository.branches.items():
+                if ref["id"] == mutation_input["refId"]:
+                    del repository.branches[name]
+                    return None
+        return {"type": "NOT_FOUND", "message": f"Could not resolve to a node with the global id of "
+                                                f"'{mutation_input['refId']}'"}
+
+    def update_refs(self, mutation_input: dict[str, Any]) -> dict[str, str] | None:
+        repository = self.by_id.get(mutation_input["repositoryId"])
+        if repository is None:
+            return {"type": "NOT_FOUND", "message": f"Could not resolve to a node with the global id of "
+                                                    f"'{mutation_input['repositoryId']}'"}
+        # all or nothing, like GitHub
+        for update in mutation_input["refUpdates"]:
+            name = update["name"].removeprefix("refs/heads/")
+            current = repository.branches.get(name, {}).get("oid", ZERO_OID)
+            if update["afterOid"] != ZERO_OID:
+                return {"type": "UNPROCESSABLE", "message": "The stand-in only supports deleting refs."}
+            if update.get("beforeOid") is not None and update["beforeOid"] != current:
+                return {"type": "UNPROCESSABLE", "message": f"Expected '{update['name']}' to point to "
+                                                            f"'{update['beforeOid']}', but it points to '{current}'."}
+        for update in mutation_input["refUpdates"]:
+            repository.branches.pop(update["name"].removeprefix("refs/heads/"), None)
+        return None
+
+
+def fixture_key(method: str, path: str, body: bytes) -> str:
+    if path.endswith("graphql"):
+        request = json.loads(body)
+        # page sizes adapt to the timing of each run, the cursors chain the recorded pages anyway
+        variables = {key: value for key, value in (request.get("variables") or {}).items() if key != "first"}
+        text = json.dumps([request["query"], variables], sort_keys=True)
+    else:
+        text = path
+    return hashlib.sha256(f"{method} {text}".encode()).hexdigest()[:24]
+
+
+class RecordingProxy:
+    """
+    Forwards the read-only requests to the real API and saves each successful answer as a
+    fixture in `folder`. Mutations and DELETE requests are refused, recording never changes a repository.
+    """
+
+    def __init__(self, folder: Path, upstream: str = "https://api.github.com"):
+        self.folder = folder
+        self.upstream = upstream.rstrip("/")
+        folder.mkdir(parents=True, exist_ok=True)
+        self.headers = threading.local()
+
+    def handle(self, method: str, path: str, body: bytes) -> Response:
+        kind = query_kind(json.loads(body)["query"]) if path.endswith("graphql") else "rest"
+        if method == "DELETE" or kind == "mutation":
+            return Response.json(403, {"message": "The recording proxy does not forward changes."}, kind)
+        request = urllib.request.Request(self.upstream + path, data=body or None, method=method, headers={
+            key: value for key, value in self.headers.value.items()
+            if key.lower() in ("authorization", "accept", "content-type", "user-agent")})
+        try:
+            with urllib.request.urlopen(request) as upstream:
+                response = Response(upstream.status, upstream.read(),
+                                    {"Content-Type": upstream.headers.get("Content-Type", "application/json")}, kind)
+        except urllib.error.HTTPError as e:
+            headers = {key: value for key, value in e.headers.items()
+                       if key.lower() in ("content-type", "retry-after", "x-ratelimit-remaining", "x-ratelimit-reset")}
+            return Response(e.code, e.read(), headers, kind)
+        if response.status == 200:
+            fixture = {
+                "request": {"method": method, "path": path, **(json.loads(body) if body else {})},
+                "status": response.status,
+                "headers": response.headers,
+                "body": response.body.decode(),
+            }
+            (self.folder / f"{fixture_key(method, path, body)}.json").write_text(json.dumps(fixture, indent=1),
+                                                                                 encoding="utf-8")
+        return response
+
+
+class Replay:
+    """
+    Serves the fixtures saved by `RecordingProxy`.
+    """
+
+    def __init__(self, folder: Path):
+        self.folder = folder
+
+    def handle(self, method: str, path: str, body: bytes) -> Response:
+        kind = query_kind(json.loads(body)["query"]) if path.endswith("graphql") else "rest"
+        key = fixture_key(method, path, body)
+        try:
+            fixture = json.loads((self.folder / f"{key}.json").read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return Response.json(501, {"message": f"No fixture recorded for {method} {path} ({key})."}, kind)
+        return Response(fixture["status"], fixture["body"].encode(), fixture["headers"], kind)
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Local HTTP server in front of a backend, counting the traffic and injecting rate limit answers.
+    """
+    daemon_threads = True
+
+    def __init__(self, backend: SyntheticGitHub | RecordingProxy | Replay, faults: Faults, port: int = 0):
+        super().__init__(("127.0.0.1", port), StandInHandler)
+        self.backend = backend
+        self.faults = faults
+        self.traffic = Traffic()
+        self.traffic_lock = threading.Lock()
+        self.counter = itertools.count(1)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def reset_traffic(self) -> Traffic:
+        with self.traffic_lock:
+            traffic, self.traffic = self.traffic, Traffic()
+        if isinstance(self.backend, SyntheticGitHub):
+            with self.backend.lock:
+                self.backend.spent = 0
+        return traffic
+
+    def respond(self, method: str, path: str, body: bytes) -> Response:
+        if self.faults.latency:
+            time.sleep(self.faults.latency)
+        every = self.faults.rate_limit_every
+        if every and next(self.counter) % every == 0:
+            response = Response.json(403, SECONDARY_RATE_LIMIT, "rate_limited",
+                                     **{"retry-after": str(self.faults.retry_after)})
+        else:
+            response = self.backend.handle(method, path, body)
+        with self.traffic_lock:
+            self.traffic.requests += 1
+            self.traffic.bytes_received += len(body)
+            self.traffic.bytes_sent += len(response.body)
+            if response.kind == "rate_limited":
+                self.traffic.rate_limited += 1
+            else:
+                self.traffic.pages[response.kind] = self.traffic.pages.get(response.kind, 0) + 1
+        return response
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # keep-alive, the client reuses its pooled connections like it does with api.github.com
+    protocol_version = "HTTP/1.1"
+    server: StandInServer
+
+    def answer(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if isinstance(self.server.backend, (RecordingProxy, SyntheticGitHub)):
+            self.server.backend.headers.value = dict(self.headers.items())
+        response = self.server.respond(self.command, urllib.parse.urlsplit(self.path).path, body)
+        self.send_response(response.status)
+        for key, value in response.headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(response.body)))
+        self.end_headers()
+        self.wfile.write(response.body)
+
+    do_GET = do_POST = do_DELETE = answer
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def measure(server: StandInServer, function: Callable[[], object], repeat: int,
+            setup: Callable[[], object] | None = None) -> dict[str, Any]:
+    """
+    Runs `function` `repeat` times and returns the wall time, traffic and inner phase
+    timings of the fastest run. `setup` runs untimed before each run.
+    """
+    best: dict[str, Any] | None = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        server.reset_traffic()
+        timings_start = len(cleanup.TIMINGS)
+        start = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - start
+        run = {"seconds": seconds, **asdict(server.reset_traffic()),
+               "timings": {name: round(value, 4) for name, value in cleanup.TIMINGS[timings_start:]}}
+        if isinstance(result, cleanup.CleanupSummary):
+            run["summary"] = {key: value for key, value in asdict(result).items() if key not in ("repo", "seconds")}
+        if best is None or seconds < best["seconds"]:
+            best = run
+    return best
+
+
+def run_benchmarks(server: StandInServer, repository_names: list[str], repeat: int, move: int) -> dict[str, dict]:
+    """
+    Times the phases of git-branch-cleanup.py on the first repository, and on all of them as an
+    organization sweep. Deletions only run against the synthetic backend, which is reset for each run.
+    """
+    get_github = getattr(cleanup, "__get_github")
+    get_repository_overview = getattr(cleanup, "__get_repository_overview")
+    synthetic = server.backend if isinstance(server.backend, SyntheticGitHub) else None
+    gh = get_github()
+    results: dict[str, dict] = {}
+    results["repository_overview"] = measure(server, lambda: get_repository_overview(gh, repository_names[0]), repeat)
+    repository = get_repository_overview(gh, repository_names[0])
+    results["branches"] = measure(server, lambda: cleanup.clean_repo(gh, repository, -1, dry_run=True), repeat)
+    if synthetic is not None:
+        # what --local-check finds in a clone: the branches nobody pushed to after their merge
+        fake = synthetic.repositories[repository_names[0]]
+        merged_locally = {name: ref["oid"] for name, ref in fake.branches.items() if name in fake.heads
+                          and fake.heads[name]["last_commits"]["nodes"][0]["commit"]["oid"] == ref["oid"]}
+        results["branches_local_check"] = measure(server, lambda: cleanup.clean_repo(
+            gh, repository, -1, merged_locally=merged_locally, dry_run=True), repeat)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        store_path = os.path.join(scratch, "pull_requests.sqlite")
+        plan_path = os.path.join(scratch, "plan.jsonl")
+
+        def with_store() -> object:
+            store = cleanup.PullRequestStore(store_path)
+            try:
+                return cleanup.clean_repo(gh, repository, -1, store, dry_run=True)
+            finally:
+                store.close()
+
+        def without_store() -> None:
+            if os.path.exists(store_path):
+                os.remove(store_path)
+        # the store is what a run uses unless --nocache is given, "branches" is the --nocache run
+        results["branches_store_cold"] = measure(server, with_store, repeat, setup=without_store)
+        results["branches_store_warm"] = measure(server, with_store, repeat)
+
+        # what --local-branches asks for: the head of every merged PR, listed or synced into the store
+        get_merged_head_oids = getattr(cleanup, "__get_merged_head_oids")
+
+        def merged_heads_with_store() -> object:
+            store = cleanup.PullRequestStore(store_path)
+            try:
+                return get_merged_head_oids(gh, repository.full_name, store, cleanup.GraphQLPacer())
+            finally:
+                store.close()
+        results["merged_heads"] = measure(
+            server, lambda: get_merged_head_oids(gh, repository.full_name, None, cleanup.GraphQLPacer()), repeat)
+        results["merged_heads_store_warm"] = measure(server, merged_heads_with_store, repeat)
+
+        def write_plan() -> object:
+            plan = cleanup.PlanWriter(plan_path)
+            try:
+                return cleanup.clean_repo(gh, repository, -1, plan=plan)
+            finally:
+                plan.close()
+        results["plan"] = measure(server, write_plan, repeat)
+        if synthetic is None:
+            return results
+
+        results["delete"] = measure(server, lambda: cleanup.clean_repo(gh, repository, -1), repeat,
+                                    setup=synthetic.reset)
+
+        def plan_and_move() -> None:
+            synthetic.reset()
+            write_plan()
+            synthetic.move_branches(move)
+        results["apply"] = measure(server, lambda: cleanup.apply_plan(plan_path), repeat, setup=plan_and_move)
+
+        if len(repository_names) > 1:
+            def sweep() -> None:
+                plan = cleanup.PlanWriter(plan_path)
+                try:
+                    # the sweep prints a JSON line per repository
+                    with redirect_stdout(io.StringIO()):
+                        cleanup.sweep_repos(SyntheticGitHub.OWNER, None, use_store=False, plan=plan)
+                finally:
+                    plan.close()
+            results["sweep_plan"] = measure(server, sweep, repeat)
+    return results
+
+
+def compare(previous: dict, current: dict) -> None:
+    print(f"{'phase':<24}{'previous':>10}{'current':>10}{'change':>9}{'pages':>14}{'KiB sent':>16}")
+    for phase, value in current["results"].items():
+        before = previous.get("results", {}).get(phase)
+        pages = sum(value["pages"].values())
+        sent = value["bytes_sent"] / 1024
+        if before is None:
+            print(f"{phase:<24}{'-':>10}{value['seconds']:>10.3f}{'':>9}{pages:>14}{sent:>16.1f}")
+            continue
+        change = f"{(value['seconds'] - before['seconds']) / before['seconds'] * 100:+.1f}%" \
+            if before["seconds"] else "-"
+        pages_change = f"{sum(before['pages'].values())}→{pages}"
+        sent_change = f"{before['bytes_sent'] / 1024:.1f}→{sent:.1f}"
+        print(f"{phase:<24}{before['seconds']:>10.3f}{value['seconds']:>10.3f}{change:>9}"
+              f"{pages_change:>14}{sent_change:>16}")
+
+
+def main() -> None:
+    defaults, default_faults = RepositorySpec(), Faults()
+    parser = argparse.ArgumentParser(description="Benchmark git-branch-cleanup.py against a local GitHub stand-in.")
+    parser.add_argument("--repos", type=int, default=defaults.repos,
+                        help="synthetic repositories, more than one adds an organization sweep")
+    parser.add_argument("--prs", type=int, default=defaults.prs, help="merged pull requests per repository")
+    parser.add_argument("--branches", type=int, default=defaults.branches,
+                        help="branches of merged pull requests left per repository")
+    parser.add_argument("--open-branches", type=int, default=defaults.open_branches,
+                        help="branches without a pull request per repository")
+    parser.add_argument("--moved", type=float, default=defaults.moved,
+                        help="share of the merged branches pushed to after their merge")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--latency", type=float, default=default_faults.latency,
+                        help="seconds added to every answer")
+    parser.add_argument("--rate-limit-every", type=int, default=default_faults.rate_limit_every,
+                        help="answer every Nth request with a secondary rate limit (default: never)")
+    parser.add_argument("--retry-after", type=int, default=default_faults.retry_after,
+                        help="retry-after seconds of the injected rate limits")
+    parser.add_argument("--move", type=int, default=5,
+                        help="branches pushed to between --plan and --apply, they must survive (default: 5)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per phase, the fastest is kept (default: 3)")
+    parser.add_argument("--serve", action="store_true", help="only run the stand-in until interrupted")
+    parser.add_argument("--port", type=int, default=0, help="port of the stand-in (default: any free one)")
+    parser.add_argument("--record", type=Path, default=None,
+                        help="proxy to api.github.com and save the answers of --repo in this folder")
+    parser.add_argument("--upstream", default="https://api.github.com", help="API proxied by --record")
+    parser.add_argument("--replay", type=Path, default=None, help="serve the answers saved by --record")
+    parser.add_argument("--repo", default=None, help="'owner/repo' to record or replay")
+    parser.add_argument("--output", type=Path, default=None, help="write the results to this JSON file")
+    parser.add_argument("--compare", type=Path, default=None, help="print the change against an earlier JSON file")
+    args = parser.parse_args()
+
+    spec = RepositorySpec(repos=args.repos, prs=args.prs, branches=args.branches, open_branches=args.open_branches,
+                          moved=args.moved, seed=args.seed)
+    faults = Faults(latency=args.latency, rate_limit_every=args.rate_limit_every, retry_after=args.retry_after)
+    if (args.record or args.replay) and not args.repo:
+        parser.error("--record and --replay need --repo")
+    if args.record:
+        backend = RecordingProxy(args.record, args.upstream)
+    elif args.replay:
+        backend = Replay(args.replay)
+    else:
+        start = time.perf_counter()
+        backend = SyntheticGitHub(spec)
+        print(f"Generated {spec.repos} repositories in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    server = StandInServer(backend, faults, args.port)
+    if args.serve:
+        print(f"Serving {', '.join(getattr(backend, 'repository_names', [args.repo]))} on {server.url}, "
+              f"use GITHUB_API_URL={server.url} GITHUB_TOKEN=x", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["GITHUB_API_URL"] = server.url
+    if not args.record:
+        # the stand-in takes any token, a real one is only needed to record
+        os.environ["GITHUB_TOKEN"] = "benchmark"
+    cleanup.SHOW_PROGRESS = False
+    cleanup.ASSUME_YES = True
+    # skipped branches are logged as warnings, one per branch and run
+    cleanup.logger.setLevel(logging.ERROR)
+
+    repository_names = [args.repo] if args.repo else backend.repository_names
+    try:
+        results = run_benchmarks(server, repository_names, args.repeat, args.move)
+    finally:
+        server.shutdown()
+
+    report = {
+        "spec": asdict(spec) if isinstance(backend, SyntheticGitHub) else {"repo": args.repo},
+        "faults": asdict(faults),
+        "repeat": args.repeat,
+        "python": platform.python_version(),
+        "pygithub": importlib.metadata.version("PyGithub"),
+        "results": results,
+    }
+    if args.compare:
+        compare(json.loads(args.compare.read_text(encoding="utf-8")), report)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
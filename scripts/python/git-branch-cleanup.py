@@ -7,7 +7,6 @@
 #   "tqdm~=4.67.1",
 #   "requests-cache~=1.2.1",
 #   "colorlog~=6.10.1",
-#   "colorama~=0.4.6",
 #   "sourcetypes3~=0.1.0",
 # ]
 # ///
@@ -24,212 +23,259 @@ Usage:
 The script detects the repo owner/name from `git remote get-url origin`.
 It prints each merged PR number, title, branch, and commit SHA.
 """
-from concurrent.futures import ThreadPoolExecutor
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
 from datetime import datetime, timedelta, timezone
+from functools import cache
+import importlib.abc
+import importlib.util
+import json
 import logging
 import os
 import re
+import sqlite3
 import subprocess
 import sys
+import threading
+import time
+import types
 import argparse
-from typing import Any, List
-
-from github import Github
-import github
-import git
-import re
-
-import colorlog
-from github.AuthenticatedUser import AuthenticatedUser
-from github.PullRequest import PullRequest
-from github.Repository import Repository
-
-from requests_cache import install_cache
-from tqdm import tqdm
-
-from sourcetypes import graphql
-
-from colorama import Fore
-
-R = Fore.RED
-G = Fore.GREEN
-B = Fore.BLUE
-Y = Fore.YELLOW
-W = Fore.WHITE
-RESET = Fore.RESET
+import asyncio
+from typing import TYPE_CHECKING, Any, Callable, Iterator, List
+from urllib.parse import quote
+
+if TYPE_CHECKING:
+    from github import Github
+    from github.AuthenticatedUser import AuthenticatedUser
+    from sourcetypes import graphql
+    from tqdm import tqdm
+
+START_TIME = time.perf_counter()
+
+# ANSI colours, the same codes colorama's Fore would give
+R = "\033[31m"
+G = "\033[32m"
+B = "\033[34m"
+Y = "\033[33m"
+W = "\033[37m"
+RESET = "\033[39m"
 
 VERBOSE = False
 VERY_VERBOSE = False
+ASSUME_YES = False
+SHOW_PROGRESS = True
 
-REPLACE_URL = re.compile(r"^https://github\.com/([^/]+)/([^/]+)/pull/(\d+)$")
+CACHE_DIR = os.path.join(os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "git-branch-cleanup")
+TOKEN_CACHE = os.path.join(CACHE_DIR, "token")
+TOKEN_CACHE_TTL = timedelta(hours=12)
 
-from github.GithubObject import (
-    Attribute,
-    GraphQlObject,
-    NotSet,
-    NonCompletableGithubObject
-)
-from github.PaginatedList import PaginatedList
+# (phase, seconds) in the order they finished, reported with --verbose
+TIMINGS: List[tuple[str, float]] = []
 
-logger = logging.getLogger(__name__)
 
-error_handler = colorlog.StreamHandler()
-error_handler.setFormatter(colorlog.ColoredFormatter(
-    '${log_color}[${levelname}] ${message}', style='$'))
-error_handler.setLevel(level=logging.WARNING)
+class TimedLoader(importlib.abc.Loader):
+    """
+    Wraps the loader of a lazily imported module to record how long executing it takes.
+    """
+
+    def __init__(self, loader: importlib.abc.Loader):
+        self.loader = loader
 
-log_handler = colorlog.StreamHandler()
-log_handler.setFormatter(colorlog.ColoredFormatter(
-    '${message}', style='$'))  # secondary_log_colors=secondary_log_colors
-log_handler.setLevel(level=logging.DEBUG)
-log_handler.addFilter(lambda record: record.levelno < logging.WARNING)
+    def create_module(self, spec: importlib.machinery.ModuleSpec) -> types.ModuleType | None:
+        return self.loader.create_module(spec)
 
-logger.addHandler(error_handler)
-logger.addHandler(log_handler)
-logger.propagate = False
+    def exec_module(self, module: types.ModuleType) -> None:
+        start = time.perf_counter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            TIMINGS.append((f"import {module.__name__}", time.perf_counter() - start))
 
 
-class CommitGQL(GraphQlObject, NonCompletableGithubObject):
+def __lazy_import(name: str) -> types.ModuleType:
     """
-    Represents a Git commit.
-    Attributes:
-        abbreviated_oid (str): The abbreviated object ID of the commit.
-        id (str): The unique identifier of the commit.
-        oid (str): The full object ID of the commit.
-        committed_date (datetime): The date when the commit was made.
-        authored_date (datetime): The date when the commit was authored.
+    Returns a module that is only imported once one of its attributes is used,
+    following the `LazyLoader` recipe of the importlib documentation.
     """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(TimedLoader(spec.loader))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
 
-    def _initAttributes(self) -> None:
-        # super()._initAttributes()
-        self._abbreviated_oid: Attribute[str] = NotSet
-        self._id: Attribute[str] = NotSet
-        self._oid: Attribute[str] = NotSet
-        self._committed_date: Attribute[datetime] = NotSet
-        self._authored_date: Attribute[datetime] = NotSet
 
-    @property
-    def abbreviated_oid(self) -> str:
-        return self._abbreviated_oid.value
+github = __lazy_import("github")
+git = __lazy_import("git")
 
-    @property
-    def id(self) -> str:
-        return self._id.value
+logger = logging.getLogger(__name__)
 
-    @property
-    def oid(self) -> str:
-        return self._oid.value
 
-    @property
-    def committed_date(self) -> datetime:
-        """
-        The commit date gets changed every time the commit is being modified, 
-        for example when rebasing the branch where the commit is in on another branch.
-        
-        :param self: Description
-        :return: Description
-        :rtype: datetime
-        """
-        return self._committed_date.value
+def __setup_logging(verbose: int) -> None:
+    import colorlog
 
-    @property
-    def authored_date(self) -> datetime:
-        """
-        The author date notes when this commit was originally made (i.e. when you finished the git commit). 
-        According to the docs of git commit, the author date could be overridden using the --date switch.
+    error_handler = colorlog.StreamHandler()
+    error_handler.setFormatter(colorlog.ColoredFormatter(
+        '${log_color}[${levelname}] ${message}', style='$'))
+    error_handler.setLevel(level=logging.WARNING)
 
-        :param self: Description
-        :return: Description
-        :rtype: datetime
-        """
-        return self._authored_date.value
-
-    def _useAttributes(self, attributes: dict[str, Any]) -> None:
-        # super class is a REST API GithubObject, attributes are coming from GraphQL
-        # super()._useAttributes(as_rest_api_attributes(attributes))
-        if "abbreviatedOid" in attributes:
-            self._abbreviated_oid = self._makeStringAttribute(attributes["abbreviatedOid"])
-        if "id" in attributes:
-            self._id = self._makeStringAttribute(attributes["id"])
-        if "oid" in attributes:
-            self._oid = self._makeStringAttribute(attributes["oid"])
-        if "committedDate" in attributes:
-            self._committed_date = self._makeDatetimeAttribute(attributes["committedDate"])
-        if "authoredDate" in attributes:
-            self._authored_date = self._makeDatetimeAttribute(attributes["authoredDate"])
-
-
-class PullRequestCommit(GraphQlObject, NonCompletableGithubObject):
-    def _initAttributes(self) -> None:
-        self._commit: Attribute[CommitGQL] = NotSet
+    log_handler = colorlog.StreamHandler()
+    log_handler.setFormatter(colorlog.ColoredFormatter(
+        '${message}', style='$'))  # secondary_log_colors=secondary_log_colors
+    log_handler.setLevel(level=logging.DEBUG)
+    log_handler.addFilter(lambda record: record.levelno < logging.WARNING)
 
-    @property
-    def commit(self) -> CommitGQL:
-        return self._commit.value
+    logger.addHandler(error_handler)
+    logger.addHandler(log_handler)
+    logger.propagate = False
+    logging.basicConfig(
+        level=logging.DEBUG if verbose >= 3 else logging.INFO,
+        format="%(message)s",
+    )
 
-    def _useAttributes(self, attributes: dict[str, Any]) -> None:
-        if "commit" in attributes:
-            self._commit = self._makeClassAttribute(CommitGQL, attributes["commit"])
 
+@contextmanager
+def __phase(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        TIMINGS.append((name, time.perf_counter() - start))
 
-class CommitsHolderGQL(GraphQlObject, NonCompletableGithubObject):
-    def _initAttributes(self) -> None:
-        self._total_count: Attribute[int] = NotSet
-        self._nodes: Attribute[List[PullRequestCommit]] = NotSet
 
-    @property
-    def total_count(self) -> int:
-        return self._total_count.value
+def __print_timings() -> None:
+    logger.info("Timings (imports are part of the phase that first needed them):")
+    for name, seconds in TIMINGS:
+        logger.info(f"\t{name:<32}{Y}{seconds * 1000:>10.1f} ms{RESET}")
+    logger.info(f"\t{'total':<32}{Y}{(time.perf_counter() - START_TIME) * 1000:>10.1f} ms{RESET}")
 
-    @property
-    def nodes(self) -> List[PullRequestCommit]:
-        return self._nodes.value
 
-    def _useAttributes(self, attributes: dict[str, Any]) -> None:
-        if "totalCount" in attributes:
-            self._total_count = self._makeIntAttribute(attributes["totalCount"])
-        if "nodes" in attributes:
-            self._nodes = self._makeListOfClassesAttribute(PullRequestCommit, attributes["nodes"])
+def __progress(**kwargs: Any) -> tqdm:
+    from tqdm import tqdm
+
+    return tqdm(disable=not SHOW_PROGRESS, **kwargs)
 
 
-class PullRequestGQL(GraphQlObject, PullRequest):
+@dataclass(frozen=True, slots=True)
+class RepositoryOverview:
     """
-    Represents a GitHub Pull Request with additional GraphQL attributes.
-    Extends the standard PullRequest class from PyGithub.
-    Attributes:
-        headref_name (str): The name of the head reference (branch) for the pull
-        request.
-        merge_commit (CommitGQL | None): The commit that merged the pull request,
-        if available.
-        viewer_can_delete_head_ref (bool): Indicates if the viewer can delete the
-        head reference.
-        last_commits (CommitsHolderGQL | None): The last commits associated with
-        the pull request.
-    """
-    def _initAttributes(self) -> None:
-        super()._initAttributes()
-        self._headref_name: Attribute[str] = NotSet
-        self._merge_commit: Attribute[CommitGQL] = NotSet
-        self._viewer_can_delete_headref: Attribute[bool] = NotSet
-        self._commits: Attribute[CommitsHolderGQL] = NotSet
+    A repository as selected by the `repository_overview` GraphQL fragment. It is fetched
+    once and reused by the whole cleanup, permissions included.
+    """
+    repository_id: str
+    full_name: str
+    url: str
+    default_branch: str | None
+    viewer_permission: str | None
+    open_pull_requests: int
+    branches: int
+
+    @classmethod
+    def from_graphql(cls, node: dict[str, Any]) -> RepositoryOverview:
+        return cls(
+            repository_id=node["id"],
+            full_name=node["nameWithOwner"],
+            url=node["url"],
+            default_branch=(node.get("defaultBranchRef") or {}).get("name"),
+            viewer_permission=node.get("viewerPermission"),
+            open_pull_requests=node["openPullRequests"]["totalCount"],
+            branches=node["branches"]["totalCount"],
+        )
 
     @property
-    def headref_name(self) -> str:
-        return self._headref_name.value
+    def viewer_can_delete_branches(self) -> bool:
+        # deleting a branch needs push access, protection rules can still refuse single branches
+        return self.viewer_permission in ("ADMIN", "MAINTAIN", "WRITE")
 
-    @property
-    def viewer_can_delete_head_ref(self) -> bool:
-        return self._viewer_can_delete_headref.value
+
+@dataclass(frozen=True, slots=True)
+class CommitRecord:
+    """
+    A Git commit as selected by the `inner_commit` GraphQL fragment, with its dates parsed.
+    Attributes:
+        oid (str): The full object ID of the commit.
+        committed_date (datetime): Changes every time the commit is modified,
+        for example when rebasing the branch where the commit is in on another branch.
+        authored_date (datetime): When this commit was originally made (i.e. when you finished
+        the git commit). It can be overridden using `git commit --date`.
+    """
+    oid: str
+    committed_date: datetime
+    authored_date: datetime
 
     @property
-    def merge_commit(self) -> CommitGQL | None:
-        return self._merge_commit.value
+    def abbreviated_oid(self) -> str:
+        return self.oid[:7]
 
+    @classmethod
+    def parse(cls, oid: str | None, committed_date: str | None, authored_date: str | None) -> "CommitRecord | None":
+        if oid is None or committed_date is None or authored_date is None:
+            return None
+        return cls(oid, datetime.fromisoformat(committed_date), datetime.fromisoformat(authored_date))
 
-    @property
-    def last_commits(self) -> CommitsHolderGQL | None:
-        return self._last_commits.value
 
+@dataclass(slots=True)
+class PullRequestRecord:
+    """
+    The fields of a merged pull request the cleanup needs, and nothing more.
+    Only the records of deletable branches are kept, so memory follows their
+    number rather than the size of the history.
+    Attributes:
+        headref_name (str): The name of the head reference (branch) for the pull request.
+        merge_commit (CommitRecord | None): The commit that merged the pull request, if available.
+        last_commit (CommitRecord | None): The last commit of the pull request, None when only
+        the merge was selected (see `BRANCH_MERGES_QUERY`).
+        commit_count (int): The number of commits in the pull request, idem.
+        branch_id (str | None): The node ID of the head branch, when the PR was found through its branch.
+        branch_oid (str | None): The commit the head branch currently points to, idem.
+        viewer_can_delete_head_ref (bool | None): Whether GitHub let the viewer delete the head branch,
+        as of the last sync for a stored PR. False for protected branches.
+    """
+    number: int
+    title: str
+    headref_name: str
+    url: str
+    author: str | None
+    merged: bool
+    merge_commit: CommitRecord | None
+    last_commit: CommitRecord | None
+    commit_count: int
+    branch_id: str | None = None
+    branch_oid: str | None = None
+    viewer_can_delete_head_ref: bool | None = None
+
+    @classmethod
+    def from_graphql(cls, node: dict[str, Any], branch_id: str | None = None,
+                     branch_oid: str | None = None) -> "PullRequestRecord":
+        """
+        Builds a record from a node selected with the `pull_request` fragment.
+        """
+        def commit(attributes: dict[str, Any] | None) -> CommitRecord | None:
+            if not attributes:
+                return None
+            return CommitRecord.parse(attributes["oid"], attributes["committedDate"], attributes["authoredDate"])
+
+        last_commits = node.get("last_commits") or {"totalCount": 0, "nodes": []}
+        return cls(
+            number=node["number"],
+            title=node["title"],
+            headref_name=node["headRefName"],
+            url=node["http_url"],
+            author=(node.get("user") or {}).get("login"),
+            merged=node["merged"],
+            merge_commit=commit(node.get("mergeCommit")),
+            last_commit=commit(last_commits["nodes"][0]["commit"]) if last_commits["nodes"] else None,
+            commit_count=last_commits["totalCount"],
+            branch_id=branch_id,
+            branch_oid=branch_oid,
+            viewer_can_delete_head_ref=node.get("viewerCanDeleteHeadRef"),
+        )
 
     @property
     def can_delete_branch(self) -> bool:
@@ -237,115 +283,743 @@ class PullRequestGQL(GraphQlObject, PullRequest):
         Determines if the branch associated with this pull request can be deleted.
         The branch can be deleted if:
         - The pull request has been merged.
-        - The viewer has permission to delete the head reference.
         - There is a merge commit associated with the pull request.
-        - The head reference is still present.
-        
+        - The pull request has a last commit to compare the branch against.
+
         :return: True if the branch can be deleted, False otherwise.
         :rtype: bool
         """
         return (
                 self.merged
-                and self.viewer_can_delete_head_ref
                 and self.merge_commit is not None
-                and self.last_commits is not None
-                and self.last_commits.total_count > 0
-                and len(self.last_commits.nodes) > 0
+                and self.last_commit is not None
+                and self.commit_count > 0
         )
 
-    def _useAttributes(self, attributes: dict[str, Any]) -> None:
-        super()._useAttributes(attributes)
-        if "http_url" in attributes:
-            api_url = REPLACE_URL.sub(lambda m: f"https://api.github.com/repos/{m.group(1)}/{m.group(2)}/pulls/{m.group(3)}",
-                attributes["http_url"])
-            super()._useAttributes({"url": api_url})
-
-        if "headRefName" in attributes:
-            self._headref_name = self._makeStringAttribute(attributes["headRefName"])
-
-        if "mergeCommit" in attributes:
-            self._merge_commit = self._makeClassAttribute(CommitGQL, attributes["mergeCommit"])
-
-        if "viewerCanDeleteHeadRef" in attributes:
-            self._viewer_can_delete_headref = self._makeBoolAttribute(attributes["viewerCanDeleteHeadRef"])
-
-        if "last_commits" in attributes:
-            self._last_commits = self._makeClassAttribute(CommitsHolderGQL, attributes["last_commits"])
-
 
-def __get_pull_request_gql(gh: github.Github, repo: str) -> PaginatedList[PullRequestGQL]:
-    query: graphql = """
+COMMIT_FRAGMENT: graphql = """
                      fragment inner_commit on Commit {
-                         abbreviatedOid
-                         id
                          oid
                          committedDate
                          authoredDate
                      }
+                     """
+
+PULL_REQUEST_FRAGMENT: graphql = COMMIT_FRAGMENT + """
+                     fragment pull_request on PullRequest {
+                         number
+                         title
+                         headRefName
+                         mergeCommit {
+                             ...inner_commit
+                         }
+                         last_commits: commits(last: 1) {
+                             totalCount
+                             nodes {
+                                 commit {
+                                     ...inner_commit
+                                 }
+                             }
+                         }
+                         merged
+                         isCrossRepository
+                         viewerCanDeleteHeadRef
+                         http_url : permalink
+                         user: author {
+                             login
+                         }
+                     }
+                     """
+
+BRANCH_FRAGMENT: graphql = PULL_REQUEST_FRAGMENT + """
+                     fragment branch on Ref {
+                         id
+                         name
+                         target {
+                             oid
+                         }
+                         associatedPullRequests(
+                             first: 3
+                             states: [MERGED]
+                             orderBy: { direction: DESC, field: UPDATED_AT }
+                         ) {
+                             nodes {
+                                 ...pull_request
+                             }
+                         }
+                     }
+                     """
+
+BRANCHES_QUERY: graphql = BRANCH_FRAGMENT + """
+                     query Q(
+                         $repo: String!
+                         $owner: String!
+                         $first: Int!
+                         $after: String
+                     ) {
+                         rateLimit {
+                             cost
+                             remaining
+                             resetAt
+                         }
+                         repository(name: $repo, owner: $owner) {
+                             refs(
+                                 refPrefix: "refs/heads/"
+                                 first: $first
+                                 after: $after
+                             ) {
+                                 totalCount
+                                 pageInfo {
+                                     endCursor
+                                     hasNextPage
+                                 }
+                                 nodes {
+                                     ...branch
+                                 }
+                             }
+                         }
+                     } \
+                     """
 
+PULL_REQUESTS_QUERY: graphql = PULL_REQUEST_FRAGMENT + """
                      query Q(
                          $repo: String!
                          $owner: String!
-                         $first: Int
-                         $last: Int
-                         $before: String
+                         $first: Int!
                          $after: String
                      ) {
+                         rateLimit {
+                             cost
+                             remaining
+                             resetAt
+                         }
                          repository(name: $repo, owner: $owner) {
                              pullRequests(
                                  first: $first
-                                 last: $last
-                                 before: $before
                                  after: $after
                                  orderBy: { direction: DESC, field: UPDATED_AT }
-                                 states: [CLOSED, MERGED]
+                                 states: [MERGED]
+                             ) {
+                                 totalCount
+                                 pageInfo {
+                                     endCursor
+                                     hasNextPage
+                                 }
+                                 nodes {
+                                     ...pull_request
+                                     updatedAt
+                                 }
+                             }
+                         }
+                     } \
+                     """
+
+BRANCH_TIPS_QUERY: graphql = """
+                     query Q(
+                         $repo: String!
+                         $owner: String!
+                         $first: Int!
+                         $after: String
+                     ) {
+                         rateLimit {
+                             cost
+                             remaining
+                             resetAt
+                         }
+                         repository(name: $repo, owner: $owner) {
+                             refs(
+                                 refPrefix: "refs/heads/"
+                                 first: $first
+                                 after: $after
+                             ) {
+                                 totalCount
+                                 pageInfo {
+                                     endCursor
+                                     hasNextPage
+                                 }
+                                 nodes {
+                                     id
+                                     name
+                                     target {
+                                         oid
+                                     }
+                                 }
+                             }
+                         }
+                     } \
+                     """
+
+# the branch tips with just enough of their newest merged PR to date the merge,
+# for the branches a local clone already proved merged (see --local-check)
+BRANCH_MERGES_QUERY: graphql = COMMIT_FRAGMENT + """
+                     query Q(
+                         $repo: String!
+                         $owner: String!
+                         $first: Int!
+                         $after: String
+                     ) {
+                         rateLimit {
+                             cost
+                             remaining
+                             resetAt
+                         }
+                         repository(name: $repo, owner: $owner) {
+                             refs(
+                                 refPrefix: "refs/heads/"
+                                 first: $first
+                                 after: $after
                              ) {
                                  totalCount
                                  pageInfo {
-                                     startCursor
                                      endCursor
                                      hasNextPage
-                                     hasPreviousPage
                                  }
                                  nodes {
-                                     number
-                                     title
-                                     headRefName
-                                     mergeCommit {
-                                         ...inner_commit
+                                     id
+                                     name
+                                     target {
+                                         oid
                                      }
-                                     last_commits: commits(last: 1) {
-                                         totalCount
+                                     merged_pull_requests: associatedPullRequests(
+                                         first: 3
+                                         states: [MERGED]
+                                         orderBy: { direction: DESC, field: UPDATED_AT }
+                                     ) {
                                          nodes {
-                                             commit {
+                                             number
+                                             title
+                                             headRefName
+                                             mergeCommit {
                                                  ...inner_commit
                                              }
+                                             merged
+                                             isCrossRepository
+                                             viewerCanDeleteHeadRef
+                                             http_url : permalink
                                          }
                                      }
-                                     merged
-                                     viewerCanDeleteHeadRef
-                                     http_url : permalink
-                                     user: author {
-                                         login
-                                     }
                                  }
                              }
                          }
                      } \
                      """
-    repo_split = repo.split("/")
-    variables = {
-        "owner": repo_split[0],
-        "repo": repo_split[1],
-
-    }
-    return PaginatedList(
-        PullRequestGQL,
-        gh.requester,
-        graphql_query=query,
-        graphql_variables=variables,
-        list_item=["repository", "pullRequests"],
-    )
+
+REPOSITORY_OVERVIEW_FRAGMENT: graphql = """
+                     fragment repository_overview on Repository {
+                         id
+                         nameWithOwner
+                         url
+                         defaultBranchRef {
+                             name
+                         }
+                         viewerPermission
+                         openPullRequests: pullRequests(states: [OPEN]) {
+                             totalCount
+                         }
+                         branches: refs(refPrefix: "refs/heads/") {
+                             totalCount
+                         }
+                     }
+                     """
+
+REPOSITORY_OVERVIEW_QUERY: graphql = REPOSITORY_OVERVIEW_FRAGMENT + """
+                     query Q(
+                         $repo: String!
+                         $owner: String!
+                     ) {
+                         rateLimit {
+                             cost
+                             remaining
+                             resetAt
+                         }
+                         repository(name: $repo, owner: $owner) {
+                             ...repository_overview
+                         }
+                     } \
+                     """
+
+VIEWER_QUERY: graphql = """
+                     query Q {
+                         rateLimit {
+                             cost
+                             remaining
+                             resetAt
+                         }
+                         viewer {
+                             login
+                         }
+                     } \
+                     """
+
+ORGANIZATION_REPOSITORIES_QUERY: graphql = REPOSITORY_OVERVIEW_FRAGMENT + """
+                     query Q(
+                         $org: String!
+                         $first: Int!
+                         $after: String
+                     ) {
+                         rateLimit {
+                             cost
+                             remaining
+                             resetAt
+                         }
+                         organization(login: $org) {
+                             repositories(
+                                 first: $first
+                                 after: $after
+                                 isArchived: false
+                                 orderBy: { direction: ASC, field: NAME }
+                             ) {
+                                 totalCount
+                                 pageInfo {
+                                     endCursor
+                                     hasNextPage
+                                 }
+                                 nodes {
+                                     ...repository_overview
+                                 }
+                             }
+                         }
+                     } \
+                     """
+
+GRAPHQL_MIN_PAGE_SIZE = 5
+GRAPHQL_FIRST_PAGE_SIZE = 25
+GRAPHQL_MAX_PAGE_SIZE = 100
+# pages answering faster than half of this grow, slower ones shrink;
+# GitHub aborts queries running longer than 10 seconds
+GRAPHQL_TARGET_SECONDS = 3.0
+# GitHub's secondary limit is 2000 points per minute, keep headroom for other clients on the token
+GRAPHQL_POINTS_PER_MINUTE = 1500
+# a mutation costs 5 secondary points however many aliased fields it holds
+GRAPHQL_MUTATION_COST = 5
+
+# branches looked up by name per query, each one selects up to three full pull requests
+BRANCH_LOOKUP_BATCH_SIZE = 25
+DELETE_BATCH_SIZE = 50
+DELETE_CONCURRENCY = 4
+DELETE_MAX_ATTEMPTS = 5
+
+SWEEP_CONCURRENCY = 4
+
+# `updateRefs` deletes a ref when its new target is the null OID
+ZERO_OID = "0" * 40
+# updateRefs is still a schema preview, without this media type GitHub doesn't know the field
+UPDATE_REFS_PREVIEW = "application/vnd.github.update-refs-preview+json"
+
+
+class GraphQLPacer:
+    """
+    Spaces GraphQL requests so a run stays under both the hourly point budget
+    reported by `rateLimit` and GitHub's per-minute secondary rate limit.
+    """
+
+    def __init__(self, points_per_minute: int = GRAPHQL_POINTS_PER_MINUTE):
+        self.points_per_minute = points_per_minute
+        self.spent: deque[tuple[float, int]] = deque()
+        self.remaining: int | None = None
+        self.reset_at: datetime | None = None
+        # one pacer can be shared by the threads of a multi-repository sweep
+        self.lock = threading.RLock()
+
+    def wait(self, expected_cost: int) -> None:
+        """
+        Blocks until a request costing `expected_cost` points can be sent.
+        Waiting threads queue up behind the lock, so a shared budget is handed out in order.
+        """
+        with self.lock:
+            self.__wait(expected_cost)
+
+    def __wait(self, expected_cost: int) -> None:
+        if self.remaining is not None and self.reset_at is not None and self.remaining < expected_cost:
+            delay = (self.reset_at - datetime.now(tz=timezone.utc)).total_seconds() + 1
+            if delay > 0:
+                logger.warning(f"GraphQL rate limit exhausted, waiting {Y}{delay:.0f}s{RESET} until it resets.")
+                time.sleep(delay)
+            self.remaining = None
+        while True:
+            now = time.monotonic()
+            while self.spent and self.spent[0][0] <= now - 60:
+                self.spent.popleft()
+            if not self.spent or sum(cost for _, cost in self.spent) + expected_cost <= self.points_per_minute:
+                return
+            time.sleep(self.spent[0][0] + 60 - now)
+
+    def record(self, rate_limit: dict[str, Any]) -> None:
+        with self.lock:
+            self.spend(rate_limit["cost"])
+            self.remaining = rate_limit["remaining"]
+            self.reset_at = datetime.fromisoformat(rate_limit["resetAt"])
+
+    def spend(self, cost: int) -> None:
+        with self.lock:
+            self.spent.append((time.monotonic(), cost))
+
+    def back_off(self, error: github.GithubException) -> None:
+        """
+        Waits out a primary or secondary rate limit response, as told by its headers.
+        """
+        delay = self.retry_delay(error)
+        logger.warning(f"Rate limited by GitHub, waiting {Y}{delay:.0f}s{RESET} before retrying.")
+        time.sleep(delay)
+
+    @staticmethod
+    def retry_delay(error: github.GithubException) -> float:
+        headers = error.headers or {}
+        if "retry-after" in headers:
+            delay = float(headers["retry-after"])
+        elif headers.get("x-ratelimit-remaining") == "0" and "x-ratelimit-reset" in headers:
+            delay = float(headers["x-ratelimit-reset"]) - time.time() + 1
+        else:
+            # GitHub asks to wait at least a minute when no header says otherwise
+            delay = 60
+        return max(delay, 1)
+
+
+class PullRequestStore:
+    """
+    Local SQLite copy of the merged pull requests of each repository, with the
+    `updatedAt` of the newest one seen as a watermark. Pull requests are listed
+    newest update first, so a sync stops at the watermark and only downloads
+    what changed since the previous run.
+    """
+    PATH = os.path.join(CACHE_DIR, "pull_requests.sqlite")
+    # bumped whenever the tables or what they hold change, older stores are dropped and synced again
+    VERSION = 4
+
+    def __init__(self, path: str = PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # concurrent sweeps share the file, wait for each other's writes
+        self.connection = sqlite3.connect(path, timeout=60)
+        with self.connection:
+            version, = self.connection.execute("PRAGMA user_version").fetchone()
+            if version != self.VERSION:
+                self.connection.execute("DROP TABLE IF EXISTS pull_requests")
+                self.connection.execute("DROP TABLE IF EXISTS watermarks")
+                self.connection.execute(f"PRAGMA user_version = {self.VERSION}")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS pull_requests (
+                repo TEXT NOT NULL,
+                number INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                head_ref TEXT NOT NULL,
+                author TEXT,
+                url TEXT NOT NULL,
+                merged INTEGER NOT NULL,
+                merge_oid TEXT,
+                merge_committed_date TEXT,
+                merge_authored_date TEXT,
+                commit_count INTEGER NOT NULL,
+                last_oid TEXT,
+                last_committed_date TEXT,
+                last_authored_date TEXT,
+                viewer_can_delete_head_ref INTEGER,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (repo, number)
+            );
+            CREATE INDEX IF NOT EXISTS pull_requests_head_ref ON pull_requests (repo, head_ref, updated_at);
+            CREATE TABLE IF NOT EXISTS watermarks (
+                repo TEXT PRIMARY KEY,
+                updated_at TEXT NOT NULL
+            );
+        """)
+
+    def watermark(self, repo: str) -> str | None:
+        row = self.connection.execute("SELECT updated_at FROM watermarks WHERE repo = ?", (repo,)).fetchone()
+        return row[0] if row else None
+
+    def store(self, repo: str, nodes: List[dict[str, Any]], watermark: str | None) -> None:
+        """
+        Saves a batch of `pullRequests` nodes and moves the watermark, in one transaction.
+        Pull requests from forks are left out, see `__newest_own_pull_request`.
+        """
+        rows = []
+        for node in nodes:
+            if node.get("isCrossRepository"):
+                continue
+            merge_commit = node.get("mergeCommit") or {}
+            last_commits = node.get("last_commits") or {"totalCount": 0, "nodes": []}
+            last_commit = last_commits["nodes"][0]["commit"] if last_commits["nodes"] else {}
+            rows.append((
+                repo, node["number"], node["title"], node["headRefName"], (node.get("user") or {}).get("login"),
+                node["http_url"], node["merged"],
+                merge_commit.get("oid"), merge_commit.get("committedDate"), merge_commit.get("authoredDate"),
+                last_commits["totalCount"],
+                last_commit.get("oid"), last_commit.get("committedDate"), last_commit.get("authoredDate"),
+                node.get("viewerCanDeleteHeadRef"), node["updatedAt"],
+            ))
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO pull_requests VALUES ({', '.join('?' * 16)})", rows)
+            if watermark is not None:
+                self.connection.execute("INSERT OR REPLACE INTO watermarks VALUES (?, ?)", (repo, watermark))
+
+    def newest_for_branch(self, repo: str, head_ref: str) -> PullRequestRecord | None:
+        """
+        Returns the newest merged pull request of a branch.
+        """
+        row = self.connection.execute(
+            "SELECT number, title, head_ref, url, author, merged, "
+            "merge_oid, merge_committed_date, merge_authored_date, "
+            "last_oid, last_committed_date, last_authored_date, commit_count, viewer_can_delete_head_ref "
+            "FROM pull_requests WHERE repo = ? AND head_ref = ? ORDER BY updated_at DESC LIMIT 1",
+            (repo, head_ref)).fetchone()
+        if row is None:
+            return None
+        (number, title, head_ref, url, author, merged,
+         merge_oid, merge_committed_date, merge_authored_date,
+         last_oid, last_committed_date, last_authored_date, commit_count, viewer_can_delete_head_ref) = row
+        return PullRequestRecord(
+            number, title, head_ref, url, author, bool(merged),
+            CommitRecord.parse(merge_oid, merge_committed_date, merge_authored_date),
+            CommitRecord.parse(last_oid, last_committed_date, last_authored_date),
+            commit_count, viewer_can_delete_head_ref=None if viewer_can_delete_head_ref is None
+            else bool(viewer_can_delete_head_ref))
+
+    def head_oids(self, repo: str) -> set[str]:
+        """
+        Returns the last commit of every merged pull request of the repository.
+        """
+        return {oid for oid, in self.connection.execute(
+            "SELECT last_oid FROM pull_requests WHERE repo = ? AND last_oid IS NOT NULL", (repo,))}
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def __is_rate_limited(error: github.GithubException) -> bool:
+    if error.status == 429:
+        return True
+    return error.status == 403 and "rate limit" in str(error.data).lower()
+
+
+def __paced_graphql_query(gh: Github, query: str, variables: dict[str, Any], pacer: GraphQLPacer) -> dict[str, Any]:
+    """
+    Sends a query that isn't paginated within the budget of `pacer`, it selects
+    `rateLimit { cost remaining resetAt }`. Rate limited requests are sent again.
+    """
+    while True:
+        pacer.wait(1)
+        try:
+            _, data = gh.requester.graphql_query(query, variables)
+            break
+        except github.GithubException as e:
+            if __is_rate_limited(e):
+                pacer.back_off(e)
+                continue
+            raise
+    pacer.record(data["data"]["rateLimit"])
+    return data
+
+
+def __paginate_graphql(gh: Github, query: str, variables: dict[str, Any], path: List[str],
+                       pacer: GraphQLPacer, progress: tqdm | None = None) -> Iterator[dict[str, Any]]:
+    """
+    Yields the nodes of the connection found at `path` in the response, one page at a time.
+    The query takes `$first`/`$after` and selects `rateLimit { cost remaining resetAt }`.
+    Pages grow while they answer quickly and shrink when they get slow or time out,
+    and are never sized larger than what is left of the rate limit.
+
+    :param progress: when given, its total is set to the connection's `totalCount`
+    """
+    page_size = GRAPHQL_FIRST_PAGE_SIZE
+    expected_cost = 1
+    after = None
+    while True:
+        pacer.wait(expected_cost)
+        start = time.monotonic()
+        try:
+            _, data = gh.requester.graphql_query(query, {**variables, "first": page_size, "after": after})
+        except github.GithubException as e:
+            if e.status in (502, 504) and page_size > GRAPHQL_MIN_PAGE_SIZE:
+                page_size = max(GRAPHQL_MIN_PAGE_SIZE, page_size // 2)
+                if VERBOSE:
+                    logger.debug(f"GraphQL page timed out, retrying with {Y}{page_size}{RESET} nodes per page.")
+                continue
+            if __is_rate_limited(e):
+                pacer.back_off(e)
+                continue
+            raise
+        elapsed = time.monotonic() - start
+        rate_limit = data["data"]["rateLimit"]
+        pacer.record(rate_limit)
+
+        connection = data["data"]
+        for key in path:
+            connection = connection[key]
+        if progress is not None:
+            progress.total = connection["totalCount"]
+        nodes = connection["nodes"]
+        yield from nodes
+        if progress is not None:
+            progress.update(len(nodes))
+        if not connection["pageInfo"]["hasNextPage"]:
+            return
+        after = connection["pageInfo"]["endCursor"]
+
+        cost_per_node = rate_limit["cost"] / max(1, page_size)
+        if elapsed < GRAPHQL_TARGET_SECONDS / 2:
+            page_size = min(GRAPHQL_MAX_PAGE_SIZE, page_size * 2)
+        elif elapsed > GRAPHQL_TARGET_SECONDS:
+            page_size = max(GRAPHQL_MIN_PAGE_SIZE, page_size // 2)
+        # spend the last points of the window on smaller pages rather than waiting for the reset
+        affordable = int(rate_limit["remaining"] / cost_per_node) if cost_per_node else page_size
+        page_size = max(GRAPHQL_MIN_PAGE_SIZE, min(page_size, affordable))
+        expected_cost = max(1, round(cost_per_node * page_size))
+        if VERY_VERBOSE:
+            logger.debug(f"GraphQL page took {elapsed:.2f}s for {rate_limit['cost']} point(s), "
+                         f"{rate_limit['remaining']} remaining, next page size {page_size}.")
+
+
+def __newest_own_pull_request(nodes: List[dict[str, Any]]) -> dict[str, Any] | None:
+    """
+    Returns the newest of the merged pull requests of a branch that were opened from the repository itself.
+    A fork's `patch-1` says nothing about the repository's own `patch-1` branch.
+    """
+    return next((node for node in nodes if not node.get("isCrossRepository")), None)
+
+
+def __get_branch_pull_requests(gh: Github, repo: str, pacer: GraphQLPacer,
+                               progress: tqdm | None = None) -> Iterator[PullRequestRecord]:
+    """
+    Yields the newest merged pull request of every branch that still exists in the repository.
+    Branches that were already deleted are never visited, whatever the size of the PR history.
+    """
+    owner, name = repo.split("/")
+    for ref in __paginate_graphql(gh, BRANCHES_QUERY, {"owner": owner, "repo": name},
+                                  ["repository", "refs"], pacer, progress):
+        # a branch name can be reused by several PRs, only the newest one reflects its state
+        pull = __newest_own_pull_request(ref["associatedPullRequests"]["nodes"])
+        if pull is not None:
+            yield PullRequestRecord.from_graphql(pull, ref["id"], ref["target"]["oid"])
+
+
+def __branch_lookup_query(count: int) -> graphql:
+    variables = " ".join(f"$ref{i}: String!" for i in range(count))
+    fields = "\n".join(f"        b{i}: ref(qualifiedName: $ref{i}) {{ ...branch }}" for i in range(count))
+    return BRANCH_FRAGMENT + (f"query Q($repo: String! $owner: String! {variables}) {{\n"
+                              f"    rateLimit {{ cost remaining resetAt }}\n"
+                              f"    repository(name: $repo, owner: $owner) {{\n{fields}\n    }}\n}}")
+
+
+def __lookup_branch_pull_requests(gh: Github, repo: str, branches: List[str],
+                                  pacer: GraphQLPacer) -> Iterator[PullRequestRecord]:
+    """
+    Yields the newest merged pull request of each of `branches`, looked up by name
+    `BRANCH_LOOKUP_BATCH_SIZE` at a time. Branches deleted meanwhile are skipped.
+    """
+    owner, name = repo.split("/")
+    for start in range(0, len(branches), BRANCH_LOOKUP_BATCH_SIZE):
+        batch = branches[start:start + BRANCH_LOOKUP_BATCH_SIZE]
+        variables = {f"ref{i}": f"refs/heads/{branch}" for i, branch in enumerate(batch)}
+        data = __paced_graphql_query(gh, __branch_lookup_query(len(batch)),
+                                     {"owner": owner, "repo": name, **variables}, pacer)
+        for i in range(len(batch)):
+            ref = data["data"]["repository"][f"b{i}"]
+            pull = __newest_own_pull_request(ref["associatedPullRequests"]["nodes"]) if ref else None
+            if pull is not None:
+                yield PullRequestRecord.from_graphql(pull, ref["id"], ref["target"]["oid"])
+
+
+def __get_locally_checked_pull_requests(gh: Github, repo: str, merged_locally: dict[str, str], pacer: GraphQLPacer,
+                                        progress: tqdm | None = None) -> Iterator[PullRequestRecord]:
+    """
+    Same as `__get_branch_pull_requests` for a repository checked against a local clone.
+    A branch whose tip the clone found in the default branch only needs its merged PR to date
+    the merge, the full PR details are looked up for the branches it couldn't decide.
+    """
+    owner, name = repo.split("/")
+    undecided: List[str] = []
+    for ref in __paginate_graphql(gh, BRANCH_MERGES_QUERY, {"owner": owner, "repo": name},
+                                  ["repository", "refs"], pacer, progress):
+        pull = __newest_own_pull_request(ref["merged_pull_requests"]["nodes"])
+        if pull is None:
+            continue
+        if merged_locally.get(ref["name"]) == ref["target"]["oid"]:
+            yield PullRequestRecord.from_graphql(pull, ref["id"], ref["target"]["oid"])
+        else:
+            undecided.append(ref["name"])
+    if VERBOSE and undecided:
+        logger.debug(f"Looking up the pull requests of {Y}{len(undecided)}{RESET} branch(es) "
+                     f"the local clone couldn't decide.")
+    yield from __lookup_branch_pull_requests(gh, repo, undecided, pacer)
+
+
+def __sync_pull_requests(gh: Github, repo: str, store: PullRequestStore, pacer: GraphQLPacer) -> None:
+    """
+    Downloads the merged pull requests updated since the last sync into `store`.
+    The watermark only moves once the sync completes, an interrupted one is redone next run.
+    """
+    owner, name = repo.split("/")
+    watermark = store.watermark(repo)
+    newest = watermark
+    batch: List[dict[str, Any]] = []
+    progress = __progress(desc="Syncing PRs", unit=" PRs")
+    for node in __paginate_graphql(gh, PULL_REQUESTS_QUERY, {"owner": owner, "repo": name},
+                                   ["repository", "pullRequests"], pacer, progress if watermark is None else None):
+        if watermark is not None and node["updatedAt"] < watermark:
+            break
+        if newest is None or node["updatedAt"] > newest:
+            newest = node["updatedAt"]
+        batch.append(node)
+        if len(batch) >= GRAPHQL_MAX_PAGE_SIZE:
+            store.store(repo, batch, None)
+            batch.clear()
+        if watermark is not None:
+            progress.update()
+    store.store(repo, batch, newest)
+    progress.close()
+    if VERBOSE:
+        logger.debug(f"Pull requests of {Y}{repo}{RESET} synced up to {Y}{newest}{RESET}.")
+
+
+def __get_stored_branch_pull_requests(gh: Github, repo: str, store: PullRequestStore, pacer: GraphQLPacer,
+                                      progress: tqdm | None = None) -> Iterator[PullRequestRecord]:
+    """
+    Same as `__get_branch_pull_requests`, but only lists the branch tips and
+    takes their pull requests from the local store, see `__sync_pull_requests`.
+    """
+    owner, name = repo.split("/")
+    for ref in __paginate_graphql(gh, BRANCH_TIPS_QUERY, {"owner": owner, "repo": name},
+                                  ["repository", "refs"], pacer, progress):
+        pull = store.newest_for_branch(repo, ref["name"])
+        if pull is not None:
+            pull.branch_id, pull.branch_oid = ref["id"], ref["target"]["oid"]
+            yield pull
+
+
+def __get_merged_head_oids(gh: Github, repo: str, store: PullRequestStore | None, pacer: GraphQLPacer) -> set[str]:
+    """
+    Returns the head commit of every merged pull request, including the ones whose branch is gone.
+    """
+    if store is not None:
+        __sync_pull_requests(gh, repo, store, pacer)
+        return store.head_oids(repo)
+    owner, name = repo.split("/")
+    oids: set[str] = set()
+    for node in __paginate_graphql(gh, PULL_REQUESTS_QUERY, {"owner": owner, "repo": name},
+                                   ["repository", "pullRequests"], pacer,
+                                   __progress(desc="Fetching merged PRs", unit=" PRs")):
+        if node.get("isCrossRepository"):
+            continue
+        for commit in node["last_commits"]["nodes"]:
+            oids.add(commit["commit"]["oid"])
+    return oids
+
+
+def __get_linked_worktrees(git_repo: git.Repo) -> dict[str, dict[str, str]]:
+    """
+    Returns the branch ref checked out in each linked worktree, with the fields of its
+    `git worktree list --porcelain` entry (`worktree`, `locked`, `prunable`...).
+    The main worktree is left out, its branch is never deleted.
+    """
+    worktrees: dict[str, dict[str, str]] = {}
+    entries = git_repo.git.worktree("list", "--porcelain").split("\n\n")
+    for entry in entries[1:]:
+        # `locked` and `detached` can come without a value
+        fields = dict((line.split(" ", 1) + [""])[:2] for line in entry.splitlines())
+        if "branch" in fields:
+            worktrees[fields["branch"]] = fields
+    return worktrees
 
 
 def __get_git_repo(path: str) -> git.Repo:
@@ -388,38 +1062,96 @@ def __parse_github_owner_repo(url: str) -> str:
     sys.exit(1)
 
 
-def __get_github() -> Github:
+@cache
+def __get_token(use_cache: bool = True) -> str | None:
     """
-    Gets the GitHub API instance, using a token from the environment or `gh` CLI if available.
-    
-    :return: Instance of the GitHub API
-    :rtype: GitHub
+    Resolves the GitHub token once per process: from `GITHUB_TOKEN`/`GH_TOKEN`, else from
+    the token file cache, else from `gh auth token`, which is then cached for `TOKEN_CACHE_TTL`.
     """
     token = os.getenv("GITHUB_TOKEN") or os.getenv("GH_TOKEN")
-    if not token:
-        # Try to use the `gh` CLI token if the user is authenticated there.
+    if token:
+        return token
+    if use_cache:
         try:
-            # `gh auth status -t` exits 0 when authenticated with a token
-            subprocess.check_call(["gh", "auth", "status", "-t"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            try:
-                out = subprocess.check_output(["gh", "auth", "token"], stderr=subprocess.DEVNULL)
-                gh_cli_token = out.decode().strip()
-                if gh_cli_token:
-                    token = gh_cli_token
+            age = time.time() - os.stat(TOKEN_CACHE).st_mtime
+            if age < TOKEN_CACHE_TTL.total_seconds():
+                with open(TOKEN_CACHE, encoding="utf-8") as file:
+                    token = file.read().strip()
+                if token:
                     if VERBOSE:
-                        logger.info("Using GitHub token from `gh auth token`.")
-            except (subprocess.CalledProcessError, FileNotFoundError):
-                # could not get token from gh; fall through to unauthenticated
-                pass
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            # gh not installed or not authenticated; fall through
+                        logger.info(f"Using GitHub token cached in {TOKEN_CACHE}.")
+                    return token
+        except OSError:
+            pass
+    # Try to use the `gh` CLI token if the user is authenticated there.
+    try:
+        # `gh auth token` exits non-zero when not authenticated
+        out = subprocess.check_output(["gh", "auth", "token"], stderr=subprocess.DEVNULL)
+        token = out.decode().strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        # gh not installed or not authenticated; fall through to unauthenticated
+        return None
+    if token and use_cache:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        descriptor = os.open(TOKEN_CACHE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        # the mode of os.open only applies to a new file, not to one left by an older version
+        os.fchmod(descriptor, 0o600)
+        with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+            file.write(token)
+    if token and VERBOSE:
+        logger.info("Using GitHub token from `gh auth token`.")
+    return token or None
+
+
+def __with_renewed_token(gh: Github, first_request: Callable[[Github], Any], pool_size: int | None = None,
+                         use_token_cache: bool = True) -> tuple[Github, Any]:
+    """
+    Sends the first request of a run. A token read from `TOKEN_CACHE` may have been revoked
+    or replaced since by `gh auth refresh` or `gh auth logout`: when GitHub answers 401, the
+    cache is dropped, `gh` is asked again and the request is sent once more from a new client.
+    Returns the client that worked and the answer.
+    """
+    try:
+        return gh, first_request(gh)
+    except github.BadCredentialsException:
+        if not use_token_cache or os.getenv("GITHUB_TOKEN") or os.getenv("GH_TOKEN"):
+            raise
+        rejected = __get_token(use_token_cache)
+        try:
+            os.remove(TOKEN_CACHE)
+        except FileNotFoundError:
             pass
+        __get_token.cache_clear()
+        if __get_token(use_token_cache) in (None, rejected):
+            raise
+        logger.warning("The cached GitHub token was rejected, using the one `gh` gives now.")
+        gh = __get_github(pool_size, use_token_cache)
+        return gh, first_request(gh)
+
 
+def __get_github(pool_size: int | None = None, use_token_cache: bool = True) -> Github:
+    """
+    Gets the GitHub API instance, using a token from the environment or `gh` CLI if available.
+    `GITHUB_API_URL` points it at another API, GitHub Enterprise or the stand-in server of
+    benchmark-git-branch-cleanup.py.
+
+    :param pool_size: Number of HTTP connections kept open, for clients shared between threads.
+    :param use_token_cache: Reuse the token `gh` gave on an earlier run instead of asking it again,
+        until GitHub rejects it, see `__with_renewed_token`.
+    :return: Instance of the GitHub API
+    :rtype: GitHub
+    """
+    token = __get_token(use_token_cache)
+    base_url = os.getenv("GITHUB_API_URL") or github.Consts.DEFAULT_BASE_URL
+    # every GraphQL page and mutation is a POST, PyGithub would sleep a second before each one;
+    # GraphQLPacer already spaces them by their cost
+    options: dict[str, Any] = dict(base_url=base_url, pool_size=pool_size,
+                                   seconds_between_requests=None, seconds_between_writes=None)
     if token:
-        gh = Github(auth=github.Auth.Token(token), per_page=100)
+        gh = github.Github(auth=github.Auth.Token(token), per_page=100, **options)
     else:
         logger.warning("no GITHUB_TOKEN found — unauthenticated requests are rate-limited.")
-        gh = Github()
+        gh = github.Github(**options)
     return gh
 
 
@@ -440,6 +1172,8 @@ def __ask_question(question: str) -> bool:
     :return: True if the user answered 'yes', False if 'no'.
     :rtype: bool
     """
+    if ASSUME_YES:
+        return True
     print()
     while True:
         answer = input(f"{Y}{question}{RESET} "
@@ -452,107 +1186,478 @@ def __ask_question(question: str) -> bool:
             print(f"Please enter '{G}y{RESET}' or '{R}n{RESET}'.")
 
 
-def __load_repo(gh: Github, directory: str, repo: str | None) -> Repository:
+def __get_repository_overview(gh: Github, full_name: str, pacer: GraphQLPacer | None = None) -> RepositoryOverview:
+    owner, name = full_name.split("/")
+    data = __paced_graphql_query(gh, REPOSITORY_OVERVIEW_QUERY, {"owner": owner, "repo": name},
+                                 pacer or GraphQLPacer())
+    return RepositoryOverview.from_graphql(data["data"]["repository"])
+
+
+def __load_repo(gh: Github, directory: str, repo: str | None) -> RepositoryOverview:
     if repo is not None:
         try:
-            return gh.get_repo(repo, lazy=False)
+            return __get_repository_overview(gh, repo)
+        except github.BadCredentialsException:
+            raise
         except Exception as e:
             raise Exception(f"Failed to load repository {repo}: {e}") from e
     try:
         git_repo = __get_git_repo(directory)
         url = __get_origin_url_from_repo(git_repo)
-        return gh.get_repo(url, lazy=False)
+        return __get_repository_overview(gh, __parse_github_owner_repo(url))
+    except github.BadCredentialsException:
+        raise
     except Exception as e:
         raise Exception(f"Failed to detect repository from git remote: {e}") from e
 
 
-def __delete_branch(pr: PullRequestGQL, force: bool = False) -> PullRequestGQL:
+def __verify_merge_dates(pr: PullRequestRecord) -> datetime | None:
+    """
+    Checks from the API data alone that the branch holds nothing newer than its merge.
+    Returns the merge date when it is safe to delete the branch, None otherwise.
+    """
+    if pr.branch_oid != pr.last_commit.oid:
+        logger.warning(
+            f"{RESET}Branch moved - Skipping PR {Y}#{pr.number:<6}{R} {B}'{pr.title}{W}: "
+            f"branch {Y}{pr.headref_name}{W} points to {Y}{pr.branch_oid[:7]}{W}, "
+            f"not to the last commit of the PR.")
+        return None
+    # verify that the merge commit is AFTER the last commit on the branch
+    merge_date = min(pr.merge_commit.authored_date,
+                     pr.merge_commit.committed_date) if pr.merge_commit else None
+    last_commit_date = max(pr.last_commit.authored_date,
+                           pr.last_commit.committed_date) if pr.last_commit else None
+    if merge_date is None or last_commit_date is None:
+        logger.warning(
+            f"{RESET}Missing dates - Skipping PR {Y}#{pr.number:<6}{R} {B}'{pr.title}{W}: "
+            f"merge_date={Y}{merge_date}{W}, "
+            f"commit_date={Y}{last_commit_date}{W}.")
+        return None
+    if merge_date < last_commit_date:
+        logger.warning(
+            f"{RESET}Suspicious commit - Skipping PR {Y}#{pr.number:<6}{R} {B}'{pr.title}{W}: "
+            f"merge commit date {Y}{merge_date}{W} is before last commit date {Y}{last_commit_date}{W}.")
+        return None
+    return merge_date
+
+
+def __get_locally_merged_branches(git_repo: git.Repo, default_branch: str) -> dict[str, str]:
+    """
+    Fetches origin once, pruning deleted branches, and returns the name and tip of every
+    remote branch reachable from the default branch, in a single `for-each-ref --merged`.
+    The fetch writes the commit-graph, which keeps the reachability walk cheap on large histories.
+    """
+    logger.debug(f"Fetching {Y}origin{RESET} to verify merged branches locally...")
+    git_repo.git(c="fetch.writeCommitGraph=true").fetch("--prune", "--quiet", "origin")
+    output = git_repo.git(c="core.commitGraph=true").for_each_ref(
+        f"--merged=refs/remotes/origin/{default_branch}",
+        "--format=%(objectname) %(refname:lstrip=3)",
+        "refs/remotes/origin/")
+    merged: dict[str, str] = {}
+    for line in output.splitlines():
+        oid, name = line.split(" ", 1)
+        if name not in ("HEAD", default_branch):
+            merged[name] = oid
+    return merged
+
+
+@dataclass
+class CleanupSummary:
+    repo: str
+    merged_branches: int = 0
+    deletable: int = 0
+    deleted: int = 0
+    gone: int = 0
+    failed: int = 0
+    seconds: float = 0.0
+    error: str | None = None
+
+
+@dataclass
+class DeleteResult:
+    """
+    A branch to delete and the mutation deleting it: `deleteRef` removes it whatever its tip,
+    `updateRefs` only while its tip is still the OID recorded in a plan.
+    """
+    repo: str
+    number: int
+    branch: str
+    mutation: str
+    input: dict[str, Any]
+    status: str = "pending"
+    attempts: int = 0
+    error: str | None = None
+
+    @classmethod
+    def delete_ref(cls, repo: str, pr: PullRequestRecord) -> DeleteResult:
+        return cls(repo, pr.number, pr.headref_name, "deleteRef", {"refId": pr.branch_id})
+
+    @classmethod
+    def compare_and_delete(cls, entry: dict[str, Any]) -> DeleteResult:
+        # one ref per mutation, a stale OID must not block the other branches of the batch
+        return cls(entry["repo"], entry["pr"], entry["branch"], "updateRefs", {
+            "repositoryId": entry["repository_id"],
+            "refUpdates": [{"name": f"refs/heads/{entry['branch']}", "beforeOid": entry["oid"],
+                            "afterOid": ZERO_OID}],
+        })
+
+
+def __delete_refs_mutation(batch: List[DeleteResult]) -> str:
+    variables = ", ".join(f"$input{i}: {result.mutation[0].upper()}{result.mutation[1:]}Input!"
+                          for i, result in enumerate(batch))
+    fields = "\n".join(f"    delete{i}: {result.mutation}(input: $input{i}) {{ clientMutationId }}"
+                       for i, result in enumerate(batch))
+    return f"mutation DeleteRefs({variables}) {{\n{fields}\n}}"
+
+
+def __get_branch_tip(gh: Github, repo: str, branch: str) -> str | None:
+    """
+    Returns the commit `branch` points to now, None when it no longer exists.
+    """
     try:
-        pr.delete_branch(force)
-        logger.info(f"{G}Deleted remote branch for PR {Y}#{pr.number:<6}{RESET}: {B}{pr.headref_name}{RESET}")
-        return pr
-    except Exception as e:
-        logger.warning(f"Failed to delete remote branch for PR #{pr.number}", e)
+        _, data = gh.requester.requestJsonAndCheck("GET", f"/repos/{repo}/git/ref/heads/{quote(branch)}")
+    except github.GithubException as e:
+        if e.status == 404:
+            return None
+        raise
+    return data["object"]["sha"]
+
+
+async def __delete_batch(gh: Github, batch: List[DeleteResult], pacer: GraphQLPacer,
+                         pacer_lock: asyncio.Lock, semaphore: asyncio.Semaphore) -> List[DeleteResult]:
+    """
+    Deletes the branches of `batch` with one aliased mutation.
+    Returns the items that failed in a way worth retrying.
+    """
+    async with semaphore:
+        async with pacer_lock:
+            await asyncio.to_thread(pacer.wait, GRAPHQL_MUTATION_COST)
+            pacer.spend(GRAPHQL_MUTATION_COST)
+        for result in batch:
+            result.attempts += 1
+        variables = {f"input{i}": result.input for i, result in enumerate(batch)}
+        headers = {"Accept": UPDATE_REFS_PREVIEW} if any(result.mutation == "updateRefs" for result in batch) else None
+        try:
+            _, data = await asyncio.to_thread(
+                gh.requester.requestJsonAndCheck, "POST", gh.requester.graphql_url, headers=headers,
+                input={"query": __delete_refs_mutation(batch), "variables": variables})
+        except github.GithubException as e:
+            if __is_rate_limited(e) or e.status >= 500:
+                delay = GraphQLPacer.retry_delay(e) if __is_rate_limited(e) else 2 ** batch[0].attempts
+                if VERBOSE:
+                    logger.debug(f"Batch of {len(batch)} deletions failed with {e.status}, retrying in {delay:.0f}s.")
+                await asyncio.sleep(delay)
+                for result in batch:
+                    result.error = f"HTTP {e.status}"
+                return batch
+            for result in batch:
+                result.status, result.error = "failed", f"HTTP {e.status}: {e.data}"
+            return []
+
+    errors: dict[int, dict[str, Any]] = {}
+    for error in data.get("errors") or []:
+        path = error.get("path") or []
+        if path and str(path[0]).startswith("delete"):
+            errors[int(str(path[0]).removeprefix("delete"))] = error
+        elif error.get("type") == "RATE_LIMITED" or not (error.get("type") or error.get("extensions")):
+            # the whole mutation failed, nothing in this batch is known to be deleted
+            for result in batch:
+                result.error = error.get("message")
+            return batch
+        else:
+            # a query GitHub rejects, unknown field or wrong input type, fails the same way every time
+            for result in batch:
+                result.status, result.error = "failed", error.get("message")
+            return []
+    retry: List[DeleteResult] = []
+    for i, result in enumerate(batch):
+        error = errors.get(i)
+        if error is None and (data.get("data") or {}).get(f"delete{i}") is not None:
+            result.status, result.error = "deleted", None
+        elif error is not None and error.get("type") == "NOT_FOUND":
+            result.status, result.error = "gone", None
+        elif error is not None and error.get("type") == "FORBIDDEN":
+            result.status, result.error = "failed", error.get("message")
+        elif error is not None and result.mutation == "updateRefs" and error.get("type") != "RATE_LIMITED":
+            # the error type of a stale beforeOid isn't documented, the branch itself tells whether it moved
+            try:
+                tip = await asyncio.to_thread(__get_branch_tip, gh, result.repo, result.branch)
+            except github.GithubException as e:
+                result.status, result.error = "failed", f"{error.get('message')}, then HTTP {e.status} reading the branch"
+                continue
+            if tip is None:
+                result.status, result.error = "gone", None
+            elif tip != result.input["refUpdates"][0]["beforeOid"]:
+                result.status, result.error = "moved", error.get("message")
+            else:
+                result.status, result.error = "failed", error.get("message")
+        else:
+            result.error = error.get("message") if error else "no result returned"
+            retry.append(result)
+    return retry
 
 
+async def __delete_branches(gh: Github, results: List[DeleteResult], batch_size: int = DELETE_BATCH_SIZE,
+                            concurrency: int = DELETE_CONCURRENCY,
+                            pacer: GraphQLPacer | None = None) -> List[DeleteResult]:
+    """
+    Deletes the branches of `results` in batches of aliased mutations, at most `concurrency`
+    batches in flight. Rate limited and failed items are retried with backoff.
+    """
+    pacer, pacer_lock, semaphore = pacer or GraphQLPacer(), asyncio.Lock(), asyncio.Semaphore(concurrency)
+    pending = results
+    with __progress(total=len(results), desc="Deleting branches") as progress:
+        for attempt in range(DELETE_MAX_ATTEMPTS):
+            if attempt > 0:
+                await asyncio.sleep(2 ** attempt)
+            batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+            retry: List[DeleteResult] = []
+            for done in asyncio.as_completed([__delete_batch(gh, batch, pacer, pacer_lock, semaphore)
+                                              for batch in batches]):
+                retried = await done
+                retry.extend(retried)
+            progress.update(len(pending) - len(retry))
+            pending = retry
+            if not pending:
+                break
+        for result in pending:
+            result.status = "failed"
+        progress.update(len(pending))
+    return results
+
+
+def __print_delete_results(results: List[DeleteResult]) -> None:
+    colors = {"deleted": G, "gone": Y, "moved": Y, "failed": R}
+    # a plan can span repositories, the branch names alone are ambiguous then
+    with_repo = len({result.repo for result in results}) > 1
+    logger.info(f"{'Repository':<40}" * with_repo + f"{'PR':<8}{'Branch':<50}{'Result':<10}{'Attempts':>8}  Error")
+    for result in sorted(results, key=lambda r: (r.status != "failed", r.repo, r.number)):
+        logger.info(f"{W}{result.repo:<40}" * with_repo + f"{Y}#{result.number:<7}{B}{result.branch:<50}"
+                    f"{colors.get(result.status, W)}{result.status:<10}{RESET}{result.attempts:>8}  "
+                    f"{result.error or ''}")
+    counts = {status: sum(1 for r in results if r.status == status) for status in colors}
+    logger.info(f"{G}{counts['deleted']}{RESET} deleted, {Y}{counts['gone']}{RESET} already gone, "
+                f"{Y}{counts['moved']}{RESET} moved since the plan, {R}{counts['failed']}{RESET} failed.")
+
+
+class PlanWriter:
+    """
+    Writes the --plan file: one JSON line per deletable branch, with the OID its tip had
+    when it was checked, written as soon as the branch is found. Shared by the threads of a sweep.
+    """
 
-def run_script(repo_name: str | None, path: str, min_age_days: int = -1, everyone: bool = False):
-    gh = __get_github()
+    def __init__(self, path: str):
+        self.file = open(path, "w", encoding="utf-8")
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def write(self, repo: RepositoryOverview, pr: PullRequestRecord) -> None:
+        line = json.dumps({
+            "repo": repo.full_name,
+            "repository_id": repo.repository_id,
+            "branch": pr.headref_name,
+            "oid": pr.branch_oid,
+            "pr": pr.number,
+            "title": pr.title,
+            "merged_at": pr.merge_commit.committed_date.isoformat(),
+        })
+        with self.lock:
+            self.file.write(line + "\n")
+            # flushed per line, an interrupted run still leaves a usable plan
+            self.file.flush()
+            self.count += 1
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def __read_plan(path: str) -> Iterator[dict[str, Any]]:
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def apply_plan(path: str, batch_size: int = DELETE_BATCH_SIZE, concurrency: int = DELETE_CONCURRENCY,
+               use_token_cache: bool = True) -> None:
+    """
+    Deletes the branches of a --plan file whose tip is still the OID recorded in it, with
+    compare-and-swap `updateRefs` mutations. Branches that moved since are left alone.
+    :param batch_size: Number of branches deleted per GraphQL mutation, any repository mixed.
+    :param concurrency: Number of mutations in flight at once.
+    """
     try:
-        repo = __load_repo(gh, path, repo_name)
+        results = [DeleteResult.compare_and_delete(entry) for entry in __read_plan(path)]
+    except (OSError, ValueError, KeyError) as e:
+        logger.critical(f"Can't read the plan {path}: {type(e).__name__}: {e}")
+        sys.exit(1)
+    if not results:
+        logger.info(f"{G}The plan has no branches to delete.{RESET}")
+        return
+    logger.info(f"The plan lists {G}{len(results)}{RESET} branch(es) "
+                f"in {Y}{len({result.repo for result in results})}{RESET} repositories.")
+    if not __ask_question("Would you like to delete the branches that did not move since the plan?"):
+        return
+    with __phase("authentication"):
+        gh = __get_github(pool_size=concurrency + 1, use_token_cache=use_token_cache)
+        # the deletions all start at once, the token is checked before
+        gh, _ = __with_renewed_token(gh, lambda client: __paced_graphql_query(client, VIEWER_QUERY, {}, GraphQLPacer()),
+                                     concurrency + 1, use_token_cache)
+    with __phase("apply plan"):
+        asyncio.run(__delete_branches(gh, results, batch_size, concurrency))
+    __print_delete_results(results)
+
+
+def run_script(repo_name: str | None, path: str, min_age_days: int = -1, everyone: bool = False,
+               use_store: bool = True, delete_batch_size: int = DELETE_BATCH_SIZE,
+               delete_concurrency: int = DELETE_CONCURRENCY, local_check: bool = False,
+               local_branches: bool = False, plan: PlanWriter | None = None):
+    with __phase("authentication"):
+        gh = __get_github(use_token_cache=use_store)
+    try:
+        with __phase("load repository"):
+            gh, repo = __with_renewed_token(gh, lambda client: __load_repo(client, path, repo_name),
+                                            use_token_cache=use_store)
     except Exception as e:
         logger.critical(e)
         sys.exit(1)
     logger.info(f"Loading data for repository: {Y}{repo.full_name}")
-    logger.info(f" There are currently {Y}{repo.get_pulls(state='open').totalCount}{RESET} open pull requests.")
-    logger.info(f" There are currently {Y}{repo.get_branches().totalCount}{RESET} branches open.")
-    clean_repo(gh, repo, min_age_days)
-
-def clean_repo(gh: Github, repo: Repository, min_age_days: int) -> None:
+    logger.info(f" There are currently {Y}{repo.open_pull_requests}{RESET} open pull requests.")
+    logger.info(f" There are currently {Y}{repo.branches}{RESET} branches open.")
+    merged_locally = None
+    if local_check:
+        git_repo = __get_git_repo(path)
+        local_name = __parse_github_owner_repo(__get_origin_url_from_repo(git_repo))
+        if local_name.lower() != repo.full_name.lower():
+            logger.warning(f"The clone at {path} is {local_name}, not {repo.full_name}: skipping the local check.")
+        else:
+            try:
+                with __phase("local reachability check"):
+                    merged_locally = __get_locally_merged_branches(git_repo, repo.default_branch)
+            except git.GitCommandError as e:
+                logger.warning(f"Local check failed, falling back to commit dates: {e}")
+    store = PullRequestStore() if use_store else None
+    try:
+        clean_repo(gh, repo, min_age_days, store, delete_batch_size, delete_concurrency, merged_locally, plan=plan)
+        if local_branches:
+            with __phase("local branches"):
+                merged_oids = __get_merged_head_oids(gh, repo.full_name, store, GraphQLPacer())
+                clean_local_branches(__get_git_repo(path), merged_oids, repo.default_branch)
+    finally:
+        if store is not None:
+            store.close()
+
+def clean_repo(gh: Github, repo: RepositoryOverview, min_age_days: int, store: PullRequestStore | None = None,
+               delete_batch_size: int = DELETE_BATCH_SIZE, delete_concurrency: int = DELETE_CONCURRENCY,
+               merged_locally: dict[str, str] | None = None, pacer: GraphQLPacer | None = None,
+               dry_run: bool = False, plan: PlanWriter | None = None) -> CleanupSummary:
     """
     Cleans up merged pull requests by deleting their remote branches if possible.
     :param repo: The GitHub repository to clean up.
-    :type repo: Repository
-    :return: None
-    :rtype: None
-    """
-    # Fetch closed PRs and filter for merged
-    logger.debug("Fetching closed pull requests and filtering merged ones...")
-    all_prs: List[PullRequestGQL] = []
-    can_delete: List[PullRequestGQL] = []
+    :type repo: RepositoryOverview
+    :param store: Local copy of the merged pull requests, only changes since the last run are downloaded.
+    :type store: PullRequestStore | None
+    :param delete_batch_size: Number of branches deleted per GraphQL mutation.
+    :param delete_concurrency: Number of mutations in flight at once.
+    :param merged_locally: Branch name to tip of the remote branches reachable from the default branch,
+        those are safe without looking at commit dates.
+    :type merged_locally: dict[str, str] | None
+    :param pacer: Rate limit budget, shared when several repositories are cleaned at once.
+    :param dry_run: Only find the deletable branches, without asking or deleting.
+    :param plan: Write the deletable branches to this plan as they are found instead of deleting them,
+        none of them is kept in memory.
+    :type plan: PlanWriter | None
+    :return: What was found and deleted.
+    :rtype: CleanupSummary
+    """
+    # Fetch the merged PRs of the branches that still exist
+    logger.debug("Fetching branches and their merged pull requests...")
+    merged_branches = 0
+    can_delete: List[PullRequestRecord] = []
+    decided_locally = 0
+    summary = CleanupSummary(repo.full_name)
+    if not repo.viewer_can_delete_branches:
+        logger.warning(f"No push access to {Y}{repo.full_name}{RESET} "
+                       f"(permission {Y}{repo.viewer_permission}{RESET}), its branches can't be deleted.")
+        return summary
     try:
-        pulls: PaginatedList[PullRequestGQL] = __get_pull_request_gql(gh, repo.full_name)
-        # repo.get_pulls(state='closed', sort='updated', direction='desc')
-        pr: PullRequestGQL
-        for pr in tqdm(pulls, total=pulls.totalCount, desc="Processing PRs"):
-            all_prs.append(pr)
+        pacer = pacer or GraphQLPacer()
+        if store is not None:
+            with __phase("sync pull requests"):
+                __sync_pull_requests(gh, repo.full_name, store, pacer)
+        fetch_start = time.perf_counter()
+        progress = __progress(desc="Processing branches", unit=" refs")
+        if store is not None:
+            pulls = __get_stored_branch_pull_requests(gh, repo.full_name, store, pacer, progress)
+        elif merged_locally is not None:
+            pulls = __get_locally_checked_pull_requests(gh, repo.full_name, merged_locally, pacer, progress)
+        else:
+            pulls = __get_branch_pull_requests(gh, repo.full_name, pacer, progress)
+        pr: PullRequestRecord
+        for pr in pulls:
+            merged_branches += 1
             # Required: merged, can delete ref, and merge commit
             try:
-                if pr.can_delete_branch:
-                    # verify that the merge commit is AFTER the last commit on the branch
-                    merge_date = min(pr.merge_commit.authored_date,
-                                     pr.merge_commit.committed_date) if pr.merge_commit else None
-                    last_commit_date = max(pr.last_commits.nodes[0].commit.authored_date, pr.last_commits.nodes[
-                        0].commit.committed_date) if pr.last_commits and pr.last_commits.total_count > 0 else None
-                    if merge_date is None or last_commit_date is None:
-                        logger.warning(
-                            f"{RESET}Missing dates - Skipping PR {Y}#{pr.number:<6}{R} {B}'{pr.title}{W}: "
-                            f"merge_date={Y}{merge_date}{W}, "
-                            f"commit_date={Y}{last_commit_date}{W}.")
+                if pr.headref_name == repo.default_branch:
+                    continue
+                if pr.viewer_can_delete_head_ref is False:
+                    if VERY_VERBOSE:
+                        logger.info(f"Skipping merged PR{W}: {Y}#{pr.number:<6}{W} {B}'{pr.title}{W}': "
+                                    f"GitHub doesn't let you delete {Y}{pr.headref_name}{W}, is it protected?")
+                    continue
+                if (merged_locally is not None and merged_locally.get(pr.headref_name) == pr.branch_oid
+                        and pr.merged and pr.merge_commit is not None):
+                    # the branch tip is in the history of the default branch, deleting it loses nothing
+                    merge_date = pr.merge_commit.committed_date
+                    decided_locally += 1
+                elif pr.can_delete_branch:
+                    merge_date = __verify_merge_dates(pr)
+                    if merge_date is None:
                         continue
-                    if merge_date >= last_commit_date:
-                        if min_age_days > 0:
-                            if merge_date <= datetime.now(tz=timezone.utc) - timedelta(days=min_age_days):
-                                can_delete.append(pr)
-                            else:
-                                if VERBOSE:
-                                    logger.debug(f"{RESET}Skipping PR {Y}#{pr.number:<6}{W} {B}'{pr.title}{W} because it is not older than {Y}{min_age_days}{W} days ")
-                        else:
-                            can_delete.append(pr)
-                    else:
-                        logger.warning(
-                            f"{RESET}Suspicious commit - Skipping PR {Y}#{pr.number:<6}{R} {B}'{pr.title}{W}: "
-                            f"merge commit date {Y}{merge_date}{W} is before last commit date {Y}{last_commit_date}{W}.")
                 else:
                     if VERY_VERBOSE:
                         logger.info(
                             f"Skipping merged PR{W}: {Y}#{pr.number:<6}{W} {B}'{pr.title}{W}': "
                             f"merged={Y}{pr.merged}{W}, "
-                            f"viewerCanDeleteHeadRef={Y}{pr.viewer_can_delete_head_ref}{W}, "
                             f"mergeCommit={Y}{'present' if pr.merge_commit else 'absent'}{W}, "
-                            f"commits_count={Y}{pr.last_commits.total_count if pr.last_commits else 'N/A'}{W}")
+                            f"commits_count={Y}{pr.commit_count}{W}")
+                    continue
+                if min_age_days > 0 and merge_date > datetime.now(tz=timezone.utc) - timedelta(days=min_age_days):
+                    if VERBOSE:
+                        logger.debug(f"{RESET}Skipping PR {Y}#{pr.number:<6}{W} {B}'{pr.title}{W} because it is not older than {Y}{min_age_days}{W} days ")
+                    continue
+                if plan is not None:
+                    plan.write(repo, pr)
+                    summary.deletable += 1
+                else:
+                    can_delete.append(pr)
             except Exception as e:
                 logger.error(
                     f"Error processing PR {Y}#{pr.number:<6}{W} {B}'{pr.title}{W}: {e}",
                     exc_info=True)
                 continue
+        progress.close()
     except Exception as e:
         logger.critical(e)
-        sys.exit(1)
+        raise SystemExit(1) from e
+    if plan is None:
+        summary.deletable = len(can_delete)
+    if merged_locally is not None and VERBOSE:
+        logger.info(f"{Y}{decided_locally}{RESET} of {Y}{summary.deletable}{RESET} branch(es) verified "
+                    f"by reachability, the others by commit dates.")
+    TIMINGS.append(("fetch branches", time.perf_counter() - fetch_start))
+    summary.merged_branches = merged_branches
+    if plan is not None:
+        if SHOW_PROGRESS:
+            logger.info(f"Planned {G}{summary.deletable}{RESET} branch(es) of {Y}{repo.full_name}{RESET} "
+                        f"for deletion, apply the plan with --apply.")
+        return summary
     can_delete.sort(key=lambda r: r.merge_commit.committed_date, reverse=True)
     if len(can_delete) == 0:
         logger.info(f"{G}No merged PRs found that can be deleted.{RESET}")
-        return
+        return summary
+    if dry_run:
+        return summary
     logger.info(f"Found {G}{len(can_delete)}{RESET} applicable merged PR(s):")
     list_pr = VERY_VERBOSE or __ask_question("Would you like to list all the PR's?")
     if list_pr:
@@ -560,15 +1665,169 @@ def clean_repo(gh: Github, repo: Repository, min_age_days: int) -> None:
             logger.info(f"{RESET}\t#{Y}{pr.number:<6}{RESET} {B}'{pr.title}'{RESET} "
                         f"on branch {Y}{pr.headref_name}{RESET} "
                         f"merged via commit {Y}{pr.merge_commit.abbreviated_oid if pr.merge_commit else 'N/A'}{RESET} "
-                        f"from {Y}{pr.last_commits.nodes[0].commit.abbreviated_oid}{RESET} "
+                        f"from {Y}{pr.branch_oid[:7]}{RESET} "
                         f"on {Y}{pr.merge_commit.committed_date if pr.merge_commit else 'N/A'}{RESET} ")
     delete_pr = __ask_question("Would you like to delete the remote branches for these PR's?")
     if delete_pr:
-        with ThreadPoolExecutor(max_workers=8) as executor:
-            #prs_to_delete_ops = {executor.submit(__delete_branch, pr): pr for pr in can_delete}
-            # for pr in tqdm(can_delete):
-            results = list(tqdm(executor.map(__delete_branch, can_delete), total=len(can_delete), desc="Deleting branches"))
+        with __phase("delete branches"):
+            results = asyncio.run(__delete_branches(gh, [DeleteResult.delete_ref(repo.full_name, pr) for pr in can_delete],
+                                                    delete_batch_size, delete_concurrency, pacer))
+        # the table is unreadable when several repositories are cleaned at once
+        if SHOW_PROGRESS:
+            __print_delete_results(results)
+        summary.deleted = sum(1 for result in results if result.status == "deleted")
+        summary.gone = sum(1 for result in results if result.status == "gone")
+        summary.failed = sum(1 for result in results if result.status == "failed")
+    return summary
+
+
+
+def __list_organization_repositories(gh: Github, org: str, pacer: GraphQLPacer) -> Iterator[RepositoryOverview]:
+    """
+    Yields the overview of every repository of an organization that is not archived, with one paged query.
+    """
+    for node in __paginate_graphql(gh, ORGANIZATION_REPOSITORIES_QUERY, {"org": org},
+                                   ["organization", "repositories"], pacer):
+        yield RepositoryOverview.from_graphql(node)
+
+
+def __read_repos_file(path: str) -> List[str]:
+    """
+    Reads one 'owner/repo' per line, blank lines and lines starting with '#' are skipped.
+    """
+    with open(path, encoding="utf-8") as file:
+        return [name for name in (line.split("#", 1)[0].strip() for line in file) if name]
+
+
+def sweep_repos(org: str | None, repos_file: str | None, min_age_days: int = -1, use_store: bool = True,
+                concurrency: int = SWEEP_CONCURRENCY, dry_run: bool = True,
+                delete_batch_size: int = DELETE_BATCH_SIZE, delete_concurrency: int = DELETE_CONCURRENCY,
+                plan: PlanWriter | None = None) -> None:
+    """
+    Cleans many repositories at once, sharing one authenticated client, its connection pool
+    and one rate limit budget. A JSON summary per repository is printed to stdout as each one finishes.
+    :param concurrency: Number of repositories cleaned at the same time.
+    :param dry_run: Only report the deletable branches.
+    :param plan: Write the deletable branches of every repository to this plan instead of deleting them.
+    """
+    pool_size = concurrency * (delete_concurrency + 1)
+    with __phase("authentication"):
+        gh = __get_github(pool_size=pool_size, use_token_cache=use_store)
+    pacer = GraphQLPacer()
+    with __phase("list repositories"):
+        if org is not None:
+            gh, repos = __with_renewed_token(
+                gh, lambda client: list(__list_organization_repositories(client, org, pacer)), pool_size, use_store)
+        else:
+            repos = __read_repos_file(repos_file)
+            # the repositories are looked up concurrently, the token is checked before
+            gh, _ = __with_renewed_token(gh, lambda client: __paced_graphql_query(client, VIEWER_QUERY, {}, pacer),
+                                         pool_size, use_store)
+    logger.info(f"Cleaning {Y}{len(repos)}{RESET} repositories, {Y}{concurrency}{RESET} at a time.")
+
+    def clean(repo: RepositoryOverview | str) -> CleanupSummary:
+        start = time.monotonic()
+        store = PullRequestStore() if use_store else None
+        try:
+            if isinstance(repo, str):
+                repo = __get_repository_overview(gh, repo, pacer)
+            summary = clean_repo(gh, repo, min_age_days, store, delete_batch_size, delete_concurrency,
+                                 pacer=pacer, dry_run=dry_run, plan=plan)
+        except (Exception, SystemExit) as e:
+            # clean_repo exits on errors, the cause is what went wrong
+            error = e.__cause__ or e
+            name = repo if isinstance(repo, str) else repo.full_name
+            summary = CleanupSummary(name, error=f"{type(error).__name__}: {error}")
+        finally:
+            if store is not None:
+                store.close()
+        summary.seconds = round(time.monotonic() - start, 3)
+        return summary
+
+    with __phase("sweep"), ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in as_completed([executor.submit(clean, repo) for repo in repos]):
+            print(json.dumps(asdict(future.result())), flush=True)
+
+
+def clean_local_branches(git_repo: git.Repo, merged_oids: set[str], default_branch: str) -> None:
+    """
+    Deletes the local branches and remote-tracking refs that point to the head of a merged PR,
+    along with the clean worktrees that have one of those branches checked out.
+    The refs are deleted in one `update-ref --stdin` transaction, each one only if it
+    still points to the commit it was matched on.
+    :param merged_oids: The head commits of the merged pull requests.
+    :param default_branch: Never deleted, neither locally nor on any remote.
+    """
+    current = None if git_repo.head.is_detached else git_repo.head.ref.path
+    protected = {f"refs/heads/{default_branch}", current}
+    candidates: dict[str, str] = {}
+    output = git_repo.git.for_each_ref("--format=%(objectname) %(refname) %(symref)", "refs/heads/", "refs/remotes/")
+    for line in output.splitlines():
+        oid, ref, *symref = line.split(" ")
+        if oid not in merged_oids or ref in protected or any(symref):
+            continue
+        if ref.startswith("refs/remotes/") and ref.split("/", 3)[3] == default_branch:
+            continue
+        candidates[ref] = oid
+
+    # forget the worktrees whose folder was deleted, their branches are free again
+    git_repo.git.worktree("prune")
+    linked_worktrees = __get_linked_worktrees(git_repo)
+    worktrees = {ref: fields["worktree"] for ref, fields in linked_worktrees.items()}
+    remove_worktrees: List[str] = []
+    for ref, fields in linked_worktrees.items():
+        if ref not in candidates:
+            continue
+        if "locked" in fields or "prunable" in fields or not os.path.isdir(fields["worktree"]):
+            # a locked worktree can live on a disk that is not mounted right now
+            logger.warning(f"Worktree {B}{fields['worktree']}{RESET} is locked or missing - "
+                           f"Skipping branch {Y}{ref}{RESET}.")
+            del candidates[ref]
+        elif git.Repo(fields["worktree"]).is_dirty(untracked_files=True):
+            logger.warning(f"Worktree {B}{fields['worktree']}{RESET} has changes - Skipping branch {Y}{ref}{RESET}.")
+            del candidates[ref]
+        else:
+            remove_worktrees.append(fields["worktree"])
+
+    if not candidates:
+        logger.info(f"{G}No local branches found that belong to merged PRs.{RESET}")
+        return
+    logger.info(f"Found {G}{len(candidates)}{RESET} local ref(s) of merged PRs"
+                f" and {G}{len(remove_worktrees)}{RESET} worktree(s) using them:")
+    if VERY_VERBOSE or __ask_question("Would you like to list them?"):
+        for ref, oid in sorted(candidates.items()):
+            worktree = f" in worktree {B}{worktrees[ref]}{RESET}" if ref in worktrees else ""
+            logger.info(f"{RESET}\t{Y}{ref}{RESET} at {Y}{oid[:7]}{RESET}{worktree}")
+    if not __ask_question("Would you like to delete these local branches and worktrees?"):
+        return
 
+    # every ref is locked and checked by `prepare` before a worktree is touched,
+    # the transaction only commits once the worktrees are gone
+    transaction = subprocess.Popen(["git", "update-ref", "--stdin"], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, text=True, cwd=git_repo.git_dir)
+    transaction.stdin.write("start\n" + "".join(f"delete {ref} {oid}\n" for ref, oid in candidates.items())
+                            + "prepare\n")
+    transaction.stdin.flush()
+    if [transaction.stdout.readline() for _ in range(2)] != ["start: ok\n", "prepare: ok\n"]:
+        _, stderr = transaction.communicate()
+        logger.error(f"Nothing was deleted, a ref changed meanwhile: {stderr.strip()}")
+        return
+    try:
+        for worktree in remove_worktrees:
+            git_repo.git.worktree("remove", worktree)
+    except git.GitCommandError as e:
+        transaction.communicate("abort\n")
+        logger.error(f"No local branch was deleted, removing a worktree failed: {e}")
+        return
+    _, stderr = transaction.communicate("commit\n")
+    if transaction.returncode != 0:
+        logger.error(f"No local branch was deleted: {stderr.strip()}")
+        return
+    with git_repo.config_writer() as config:
+        for ref in candidates:
+            if ref.startswith("refs/heads/"):
+                config.remove_section(f'branch "{ref.removeprefix("refs/heads/")}"')
+    logger.info(f"{G}Deleted {len(candidates)} local ref(s) and {len(remove_worktrees)} worktree(s).{RESET}")
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Clean up local git branches for merged PRs.")
@@ -588,7 +1847,7 @@ if __name__ == '__main__':
         '--verbose', '-v',
         action='count',
         default=0,
-        help='Increase verbosity level'
+        help='Increase verbosity level, also reports the time spent importing and in each phase'
     )
     parser.add_argument(
         "-f", "--force",
@@ -598,7 +1857,11 @@ if __name__ == '__main__':
     parser.add_argument(
         "--nocache",
         action="store_true",
-        help="Disable HTTP caching for GitHub API requests",
+        help=f"Disable HTTP caching for GitHub API requests and the local pull request store "
+             f"({PullRequestStore.PATH}), which single repository runs, --local-branches and "
+             f"--org/--repos-file sweeps otherwise keep in sync; --apply never uses the store. "
+             f"Also stop reusing the token `gh auth token` gave, kept in {TOKEN_CACHE} for "
+             f"{TOKEN_CACHE_TTL.total_seconds() / 3600:g} hours unless GitHub rejects it first",
     )
     parser.add_argument(
         "-y", "--yes",
@@ -611,22 +1874,99 @@ if __name__ == '__main__':
         default=-1,
         help="Minimum age in days of the merged PRs to consider for branch deletion",
     )
+    parser.add_argument(
+        "--org",
+        default=None,
+        help="Clean every repository of this organization that is not archived, "
+             "a JSON summary per repository is printed to stdout, branches are only deleted with --yes",
+    )
+    parser.add_argument(
+        "--repos-file",
+        default=None,
+        help="Clean the repositories listed in this file, one 'owner/repo' per line, "
+             "branches are only deleted with --yes",
+    )
+    parser.add_argument(
+        "--repo-concurrency",
+        type=int,
+        default=SWEEP_CONCURRENCY,
+        help=f"Number of repositories cleaned at once with --org/--repos-file (default: {SWEEP_CONCURRENCY})",
+    )
+    parser.add_argument(
+        "--local-check",
+        action="store_true",
+        help="Fetch the clone at --path and trust branches reachable from the default branch, "
+             "commit dates are only compared for the others",
+    )
+    parser.add_argument(
+        "--local-branches",
+        action="store_true",
+        help="Also delete the local branches, remote-tracking refs and clean worktrees of the clone at --path "
+             "that point to the head of a merged PR",
+    )
+    plan_group = parser.add_mutually_exclusive_group()
+    plan_group.add_argument(
+        "--plan",
+        metavar="FILE",
+        default=None,
+        help="Write the deletable branches and their tip OIDs to this JSON lines file as they are found, "
+             "nothing is deleted",
+    )
+    plan_group.add_argument(
+        "--apply",
+        metavar="FILE",
+        default=None,
+        help="Delete the branches of a --plan file whose tip did not move since, without looking at pull requests",
+    )
+    parser.add_argument(
+        "--delete-batch-size",
+        type=int,
+        default=DELETE_BATCH_SIZE,
+        help=f"Number of branches deleted per GraphQL mutation (default: {DELETE_BATCH_SIZE})",
+    )
+    parser.add_argument(
+        "--delete-concurrency",
+        type=int,
+        default=DELETE_CONCURRENCY,
+        help=f"Number of deletion mutations in flight at once (default: {DELETE_CONCURRENCY})",
+    )
 
     args = parser.parse_args()
+    if (args.org or args.repos_file) and (args.local_check or args.local_branches):
+        parser.error("--local-check and --local-branches work on the clone at --path, "
+                     "they can't be combined with --org or --repos-file")
+    TIMINGS.append(("startup", time.perf_counter() - START_TIME))
 
     if args.verbose >= 1:
         VERBOSE = True
     if args.verbose >= 2:
         VERY_VERBOSE = True
-    logging.basicConfig(
-        level=logging.DEBUG if args.verbose >= 3 else logging.INFO,
-        format="%(message)s",
-    )
+    __setup_logging(args.verbose)
     if not args.nocache:
         if VERBOSE:
             logger.debug("Enabling HTTP caching for GitHub API requests...")
-        install_cache(
-            cache_control=True,
-        )
-    args = parser.parse_args()
-    run_script(args.repo, args.path, args.min_age_days)
+        with __phase("HTTP cache"):
+            from requests_cache import install_cache
+            install_cache(
+                cache_control=True,
+            )
+    ASSUME_YES = args.yes
+    plan = PlanWriter(args.plan) if args.plan else None
+    try:
+        if args.apply:
+            apply_plan(args.apply, args.delete_batch_size, args.delete_concurrency, use_token_cache=not args.nocache)
+        elif args.org or args.repos_file:
+            SHOW_PROGRESS = False
+            sweep_repos(args.org, args.repos_file, args.min_age_days, use_store=not args.nocache,
+                        concurrency=args.repo_concurrency, dry_run=not args.yes,
+                        delete_batch_size=args.delete_batch_size, delete_concurrency=args.delete_concurrency,
+                        plan=plan)
+        else:
+            run_script(args.repo, args.path, args.min_age_days, use_store=not args.nocache,
+                       delete_batch_size=args.delete_batch_size, delete_concurrency=args.delete_concurrency,
+                       local_check=args.local_check, local_branches=args.local_branches, plan=plan)
+    finally:
+        if plan is not None:
+            plan.close()
+        if VERBOSE:
+            __print_timings()